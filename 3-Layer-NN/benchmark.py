@@ -0,0 +1,132 @@
+"""
+Benchmark of the hot paths of the character recognition, on the bundled Dataset (nothing is downloaded)
+
+Reports images/sec for the feature extraction (serial and with each number of workers), samples/sec for the forward
+and backward passes at each batch size, the time of a training epoch (full batch gradient descent and mini batch adam)
+and the peak memory of each of them. The stage timers of NeuralNet are turned on during training and saved with the results
+
+Example
+python benchmark.py
+python benchmark.py --repeats 5 --batch-sizes 1 32 1024 --workers 1 2 4 --json benchmark.json
+"""
+import argparse
+import json
+import os
+import resource
+import time
+import tracemalloc
+import numpy as np
+from feature_extractor import feature_extractor, extract_features_batch, extract_features_parallel
+from neural_net import NeuralNet
+from optimizers import Adam
+from utils import extract_label
+
+def measure(function, repeats = 1):
+    """
+    Run function repeats times
+    Output: seconds of the fastest run, peak memory allocated during the runs (in bytes), result of the last run
+    """
+    tracemalloc.start()
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, result
+
+def repeat(function, count):
+    """
+    Call function count times, throwing its results away so they don't add up in the peak memory
+    """
+    for _ in range(count):
+        function()
+
+def report(results, name, seconds, peak, count, unit):
+    results[name] = {"seconds" : seconds, f"{unit}_per_second" : count / seconds, "peak_memory_mb" : peak / 2**20}
+    print(f"  {name:<36} {seconds * 1000:10.3f} ms {count / seconds:14.1f} {unit}/s {peak / 2**20:8.2f} MB peak")
+
+def benchmark_extraction(image_filenames, repeats, workers_list):
+    print(f"\nFeature extraction: {len(image_filenames)} images")
+    results = {}
+    seconds, peak, _ = measure(lambda: [feature_extractor(image_filename) for image_filename in image_filenames], repeats)
+    report(results, "feature_extractor", seconds, peak, len(image_filenames), "images")
+    seconds, peak, _ = measure(lambda: extract_features_batch(image_filenames), repeats)
+    report(results, "extract_features_batch", seconds, peak, len(image_filenames), "images")
+    for workers in workers_list:
+        seconds, peak, _ = measure(lambda: list(extract_features_parallel(image_filenames, workers)), repeats)
+        report(results, f"extract_features_parallel {workers} workers", seconds, peak, len(image_filenames), "images")
+    return results
+
+def benchmark_passes(network, features, targets, batch_sizes, repeats):
+    print("\nForward and backward passes")
+    results = {}
+    for batch_size in batch_sizes:
+        ##the dataset is repeated to fill the bigger batches
+        rows = np.resize(np.arange(len(features)), batch_size)
+        batch_inputs, batch_targets = features[rows], targets[rows]
+        inner = max(1, 10000 // batch_size) ##enough passes to time the small batches
+        seconds, peak, _ = measure(lambda: repeat(lambda: network.forward_nn(batch_inputs), inner), repeats)
+        report(results, f"forward batch {batch_size}", seconds / inner, peak, batch_size, "samples")
+        seconds, peak, _ = measure(lambda: repeat(lambda: network.gradients(batch_inputs, batch_targets), inner), repeats)
+        report(results, f"forward + backward batch {batch_size}", seconds / inner, peak, batch_size, "samples")
+    return results
+
+def benchmark_training(features, targets, epochs, seed = 7):
+    print(f"\nTraining: {len(features)} samples")
+    results = {}
+    profiles = {}
+
+    ##full batch gradient descent, one iteration is one epoch over the data
+    np.random.seed(seed)
+    network = NeuralNet(features.shape[1], 20, 15, 0.5)
+    network.enable_profiling()
+    network.update_training_data(features, targets)
+    network.max_iteration = epochs - 1
+    seconds, peak, _ = measure(network.train)
+    ##train stops early when the error is low enough, each iteration is one pass over the data
+    report(results, "gradient descent epoch", seconds / network.iteration, peak, len(features), "samples")
+    profiles["gradient_descent"] = network.profile_report()
+
+    ##mini batch adam, without early stopping so every run has the same number of epochs
+    np.random.seed(seed)
+    network = NeuralNet(features.shape[1], 20, 15, 0.03)
+    network.enable_profiling()
+    seconds, peak, history = measure(lambda: network.fit(features, targets, Adam(0.03), 8, epochs, True, 0.0, epochs))
+    report(results, "adam epoch (batch 8)", seconds / len(history), peak, len(features), "samples")
+    profiles["adam"] = network.profile_report()
+
+    return results, profiles
+
+def load_dataset(directories):
+    image_filenames = [os.path.join(directory, image_file) for directory in directories for image_file in sorted(os.listdir(directory))]
+    targets = np.array([extract_label(os.path.basename(image_filename)) for image_filename in image_filenames])
+    return image_filenames, targets
+
+
+if __name__ == "__main__":
+    directory = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description = "Benchmark the feature extraction and the training of the character recognition")
+    parser.add_argument("--datasets", nargs = "+", default = [os.path.join(directory, "Dataset", "Train"), os.path.join(directory, "Dataset", "Test")])
+    parser.add_argument("--repeats", type = int, default = 3, help = "the fastest of the repeats is reported")
+    parser.add_argument("--workers", type = int, nargs = "*", default = [1, os.cpu_count() or 1], help = "numbers of worker processes for the feature extraction")
+    parser.add_argument("--batch-sizes", type = int, nargs = "+", default = [1, 32, 1024])
+    parser.add_argument("--epochs", type = int, default = 200)
+    parser.add_argument("--json", default = None, help = "save the results and the stage timers of NeuralNet into this file")
+    args = parser.parse_args()
+
+    image_filenames, targets = load_dataset(args.datasets)
+    results = {"extraction" : benchmark_extraction(image_filenames, args.repeats, args.workers)}
+
+    features = extract_features_batch(image_filenames)
+    np.random.seed(7)
+    results["passes"] = benchmark_passes(NeuralNet(features.shape[1], 20, 15, 0.5), features, targets, args.batch_sizes, args.repeats)
+    results["training"], results["stage_timers"] = benchmark_training(features, targets, args.epochs)
+
+    results["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"\nMax resident memory: {results['max_rss_mb']:.1f} MB")
+
+    if args.json is not None:
+        with open(args.json, "w") as output:
+            output.write(json.dumps(results, indent=4))
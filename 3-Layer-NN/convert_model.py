@@ -0,0 +1,19 @@
+from inference_test import load_json_model
+import argparse
+import numpy as np
+
+def convert_json_model(json_file, binary_file, dtype = np.float64):
+    """
+    Convert a model saved as json by NeuralNet.saving_weights_bias into the binary format of NeuralNet.saving_model
+    """
+    load_json_model(json_file).saving_model(binary_file, dtype)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Convert a json model into the binary model format")
+    parser.add_argument("json_file", nargs = "?", default = "char_recognition.json")
+    parser.add_argument("binary_file", nargs = "?", default = "char_recognition.npy")
+    parser.add_argument("--float32", action = "store_true", help = "save the weights and bias as float32 instead of float64")
+    args = parser.parse_args()
+
+    convert_json_model(args.json_file, args.binary_file, np.float32 if args.float32 else np.float64)
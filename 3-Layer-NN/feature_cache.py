@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import numpy as np
+import feature_extractor
+from feature_extractor import extract_features_parallel, FEATURE_SIZE
+
+CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".feature_cache")
+INITIAL_CAPACITY = 1024 ##number of rows of a new store, doubled when it is full
+
+def extractor_parameters():
+    """
+    Everything the features depend on apart from the image itself, the cache is emptied when any of it changes
+    """
+    return {"image_size" : list(feature_extractor.IMAGE_SIZE), "blur_sigma" : feature_extractor.BLUR_SIGMA,
+            "blur_kernel_size" : list(feature_extractor.BLUR_KERNEL_SIZE), "threshold" : feature_extractor.THRESHOLD,
+            "dwt_levels" : feature_extractor.DWT_LEVELS, "feature_size" : FEATURE_SIZE}
+
+def file_hash(image_filename):
+    with open(image_filename, "rb") as image_file:
+        return hashlib.sha256(image_file.read()).hexdigest()
+
+class FeatureCache():
+    """
+    On-disk cache of the features of the images
+    The features are rows of a memory-mapped .npy store, and index.json maps the hash of the content of each image
+    to its row. As the key is the content and not the filename, an image that is changed is extracted again,
+    and the index also saves the extractor parameters so the whole cache is dropped when they change
+    Only one process should write into a cache directory at a time
+    """
+    def __init__(self, directory = CACHE_DIRECTORY):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.json")
+        self.store_path = os.path.join(directory, "features.npy")
+        self.parameters = extractor_parameters()
+        self.rows = {}
+        self.count = 0
+        self.store = None
+
+        if os.path.exists(self.index_path) and os.path.exists(self.store_path):
+            with open(self.index_path, "r") as index_file:
+                index = json.loads(index_file.read())
+            if index["parameters"] == self.parameters:
+                self.rows = index["rows"]
+                self.count = index["count"]
+                self.store = np.load(self.store_path, mmap_mode="r+")
+
+    def lookup(self, key):
+        """
+        The features saved for this hash, or None
+        """
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        return np.array(self.store[row]) ##copied, the store is mapped again when it grows
+
+    def add(self, key, features):
+        if self.store is None or self.count == len(self.store):
+            self.grow()
+        self.store[self.count] = features
+        self.rows[key] = self.count
+        self.count += 1
+
+    def grow(self):
+        """
+        Double the capacity of the store, the rows already saved are copied into the new one
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        capacity = max(INITIAL_CAPACITY, 2 * (len(self.store) if self.store is not None else 0))
+        temporary_path = self.store_path + ".tmp.npy"
+        new_store = np.lib.format.open_memmap(temporary_path, mode="w+", dtype=np.float64, shape=(capacity, FEATURE_SIZE))
+        new_store[:self.count] = self.store[:self.count] if self.store is not None else 0
+        new_store.flush()
+        del new_store
+        self.store = None
+        os.replace(temporary_path, self.store_path)
+        self.store = np.load(self.store_path, mmap_mode="r+")
+
+    def save(self):
+        """
+        Write the store and the index to disk, the index is replaced in one go so a reader never sees half of it
+        """
+        if self.store is None:
+            return
+        self.store.flush()
+        temporary_path = self.index_path + ".tmp"
+        with open(temporary_path, "w") as index_file:
+            index_file.write(json.dumps({"parameters" : self.parameters, "count" : self.count, "rows" : self.rows}))
+        os.replace(temporary_path, self.index_path)
+
+    def features(self, image_filenames, workers = None):
+        """
+        Generator of the features of each image, in the same order as image_filenames
+        The images that are not in the cache are extracted with extract_features_parallel and added to the cache
+        """
+        keys = [file_hash(image_filename) for image_filename in image_filenames]
+        missing = {} ##the same image can be given twice, it is only extracted once
+        for image_filename, key in zip(image_filenames, keys):
+            if key not in self.rows and key not in missing:
+                missing[key] = image_filename
+        extracted = extract_features_parallel(list(missing.values()), workers)
+
+        try:
+            for key in keys:
+                features = self.lookup(key)
+                if features is None:
+                    features = next(extracted)
+                    self.add(key, features)
+                yield features
+        finally:
+            self.save()
+
+def extract_features_cached(image_filenames, workers = None, use_cache = True):
+    """
+    extract_features_parallel reading through the cache in CACHE_DIRECTORY (or not at all when use_cache is False)
+    """
+    if use_cache:
+        return FeatureCache().features(image_filenames, workers)
+    return extract_features_parallel(image_filenames, workers)
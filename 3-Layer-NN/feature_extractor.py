@@ -1,32 +1,80 @@
 from PIL import Image
 import numpy as np
 from scipy.signal import convolve2d
+from concurrent.futures import ProcessPoolExecutor
+import io
 import math
+import os
+
+IMAGE_SIZE = (28,28)
+BLUR_SIGMA = 1
+BLUR_KERNEL_SIZE = (3,3)
+THRESHOLD = 90
+DWT_LEVELS = 2
+FEATURE_SIZE = (IMAGE_SIZE[0] >> DWT_LEVELS) * (IMAGE_SIZE[1] >> DWT_LEVELS) ##49 values per image
+CHUNK_SIZE = 16 ##number of images sent to a worker process at once
+
+##sobel kernels
+KX = np.array([[-1, 0, 1], [-2, 0, 2], [-1, 0, 1]])
+KY = np.array([[-1, -2, -1], [0, 0, 0], [1, 2, 1]])
 
 def feature_extractor(image_filename):
     image = Image.open(image_filename)
-    
+
     ###resize it
-    image = image.resize((28,28))
+    image = image.resize(IMAGE_SIZE)
 
     ##convert it to grayscale and into array
     image = np.array(image.convert("L"))
 
     ##try to remove the noise added
-    image = gaussian_blur(image,1,(3,3))
+    image = gaussian_blur(image,BLUR_SIGMA,BLUR_KERNEL_SIZE)
 
-    ##Extract edges with sobel
-    image = sobel_and_angle_calculation(image)[0]
+    ##Extract edges with sobel, the angle is not used
+    image = sobel_and_angle_calculation(image, compute_angle=False)[0]
 
     ##threshold to binarize the image
-    image = binarize(image, 90)
+    image = binarize(image, THRESHOLD)
 
     ##apply dwt to get ll band
-    image = dwt_ll(image, 2)
+    image = dwt_ll(image, DWT_LEVELS)
 
     ##flatten it
     return np.ndarray.flatten(image)
 
+def extract_features_batch(image_filenames):
+    """
+    feature_extractor for a list of images, gives back an (N, 49) array with one row per image
+    """
+    features = np.empty((len(image_filenames), FEATURE_SIZE))
+    for index, image_filename in enumerate(image_filenames):
+        features[index] = feature_extractor(image_filename)
+    return features
+
+def extract_features_from_bytes(images):
+    """
+    extract_features_batch for images given as the bytes of the image files instead of filenames
+    """
+    return extract_features_batch([io.BytesIO(image) for image in images])
+
+def extract_features_parallel(image_filenames, workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Generator of the features of each image, in the same order as image_filenames
+    The images are decoded and processed by a pool of worker processes, chunk_size images at a time, and each chunk
+    is given back as soon as it and the ones before it are done, so the caller can start before every image is processed
+    With a single worker (or a single chunk), everything runs in this process
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = [image_filenames[start:start + chunk_size] for start in range(0, len(image_filenames), chunk_size)]
+    if workers == 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield from extract_features_batch(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+        for features in executor.map(extract_features_batch, chunks):
+            yield from features
+
 def dwt_ll(image, levels):
     image = image.astype(float) ##because we are performing averaging
     for _ in range(levels):
@@ -34,64 +82,48 @@ def dwt_ll(image, levels):
     return image
 
 def dwt_ll_helper(image):
-    result = np.zeros((image.shape[0]//2, image.shape[1]//2))
+    ##every 2x2 block of the image, blocks[i, :, j, :] is the block at row i and col j of the result
+    blocks = image.reshape(image.shape[0]//2, 2, image.shape[1]//2, 2)
 
     ##perform dwt on row
-    for row in range(len(image)):
-        for col in range(0,len(image[0]),2):
-            image[row][col//2] = (image[row][col] + image[row][col+1]) / 2
-    
-    ##perform dwt on col
-    for col in range(len(image[0])//2):
-        for row in range(0,len(image),2):
-            result[row//2][col] = (image[row][col] + image[row+1][col]) / 2
-    
-    return result
+    rows = (blocks[:, :, :, 0] + blocks[:, :, :, 1]) / 2
 
+    ##perform dwt on col
+    return (rows[:, 0, :] + rows[:, 1, :]) / 2
 
-def sobel_and_angle_calculation(image_array):
-    ##prepare the kernel 
-    Kx = np.matrix('-1, 0, 1; -2, 0, 2;, -1, 0, 1')
-    Ky = np.matrix('-1, -2, -1; 0, 0, 0;, 1, 2, 1')
 
+def sobel_and_angle_calculation(image_array, compute_angle=True):
     ##Apply kernel to the image
-    Gx = convolve2d(image_array, Kx, "same")
-    Gy = convolve2d(image_array, Ky, "same")
+    Gx = convolve2d(image_array, KX, "same")
+    Gy = convolve2d(image_array, KY, "same")
     magnitude_array = np.sqrt(Gx**2 + Gy**2)
 
+    if not compute_angle:
+        return magnitude_array.astype(np.uint8), None
+
     ##now to get the angle array
     angle_array = np.arctan2(Gy, Gx) * (180/math.pi) ##since the output is in radian, we need to convert them to angle
 
     ##to convert to positive angle
-    filter_angle = np.vectorize(convert_to_positive_angle)
-    angle_array = filter_angle(angle_array)
+    angle_array = convert_to_positive_angle(angle_array)
 
     return magnitude_array.astype(np.uint8), angle_array.astype(np.uint8)
 
-def convert_to_positive_angle(item):
-    if item > 90:
-        return 450 - item
-    else:
-        return 90 - item
+def convert_to_positive_angle(angle_array):
+    return np.where(angle_array > 90, 450 - angle_array, 90 - angle_array)
 
 def binarize(image, threshold_value):
-    convert_binary = np.vectorize(thresholding)
-    binary_image = convert_binary(image, threshold_value)
+    ##1 where the pixel reaches the threshold, 0 otherwise
+    binary_image = (image >= threshold_value).astype(int)
     return binary_image
 
-def thresholding(item,threshold_value):
-    if item < threshold_value:
-        return 0
-    else:
-        return 1
-    
 def generate_gaussian_kernel(sigma : float, size : tuple):
     assert size[0] % 2 == 1 and size[1] % 2 == 1 and size[0] == size[1]
     ##size[0] is for row, size[1] is for col
     kernel = [None] * size[0]
     for i in range(len(kernel)):
         kernel[i] = [None] * size[1]
-    
+
     sum_kernel = 0
 
     ##the calculation starts here
@@ -104,17 +136,23 @@ def generate_gaussian_kernel(sigma : float, size : tuple):
             result =  first_part * second_part
             kernel[y+offset][x+offset] = result
             sum_kernel += result
-    
-    
+
+
     # now to normalize the kernel
     for y in range(size[0]):
         for x in range(size[1]):
             kernel[y][x] = round((kernel[y][x] / sum_kernel), 3)
-    
+
     return kernel
 
+##the kernel used by feature_extractor is only generated once
+GAUSSIAN_KERNEL = np.array(generate_gaussian_kernel(BLUR_SIGMA, BLUR_KERNEL_SIZE))
+
 def gaussian_blur(image_array, sigma, kernel_size):
-    gaussian_kernel = generate_gaussian_kernel(sigma,kernel_size)
+    if sigma == BLUR_SIGMA and tuple(kernel_size) == BLUR_KERNEL_SIZE:
+        gaussian_kernel = GAUSSIAN_KERNEL
+    else:
+        gaussian_kernel = generate_gaussian_kernel(sigma,kernel_size)
     filtered_image = convolve2d(image_array, gaussian_kernel, "same")
 
     ##change it to integer
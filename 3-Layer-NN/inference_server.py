@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from feature_extractor import extract_features_from_bytes
+from inference_test import load_model
+from utils import label_to_char
+
+MAX_BATCH_SIZE = 64 ##most images scored by the network at once
+MAX_DELAY = 0.002 ##seconds the first request of a micro batch waits for others to join it
+LATENCY_SAMPLES = 10000 ##latencies kept for each stage of the stats
+STAGES = ["read", "extract", "queue", "model", "total"]
+
+class LatencyStats():
+    """
+    The latest latencies of each stage of the requests, in seconds
+    """
+    def __init__(self, samples = LATENCY_SAMPLES):
+        self.latencies = {stage : deque(maxlen=samples) for stage in STAGES}
+        self.requests = 0
+        self.images = 0
+        self.batches = 0
+
+    def add(self, timings):
+        for stage, latency in timings.items():
+            self.latencies[stage].append(latency)
+
+    def summary(self):
+        stages = {}
+        for stage, latencies in self.latencies.items():
+            if len(latencies) == 0:
+                continue
+            latencies_ms = np.array(latencies) * 1000
+            stages[stage] = {"mean_ms" : float(latencies_ms.mean()), "p50_ms" : float(np.percentile(latencies_ms, 50)),
+                             "p99_ms" : float(np.percentile(latencies_ms, 99)), "max_ms" : float(latencies_ms.max())}
+        return {"requests" : self.requests, "images" : self.images, "batches" : self.batches,
+                "average_batch_size" : self.images / self.batches if self.batches else 0, "stages" : stages}
+
+class InferenceServer():
+    """
+    Keep the model loaded and score the images sent over HTTP (on a TCP port or a unix socket)
+
+    POST /predict with the bytes of an image as the body, or a json body {"images" : [base64 images]} or {"paths" : [image filenames]}
+    gives back {"predictions" : [{"char", "label", "confidence"}], "timings_ms" : {stage : latency}}
+    GET /stats gives back the latency of each stage over the latest requests
+
+    The features are extracted by a pool of worker processes. The requests waiting for the model are grouped into micro batches,
+    the first request of a batch waits at most max_delay for others to join it, and the whole batch goes through predict_batch at once
+    """
+    def __init__(self, model, workers = None, max_batch_size = MAX_BATCH_SIZE, max_delay = MAX_DELAY):
+        self.model = model
+        ##the workers are not forked from the server, a forked worker would inherit the sockets of the open connections
+        ##and keep them open after the server closes them, so the clients would never see the end of the response
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(start_method))
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.queue = None
+        self.batcher = None
+        self.stats = LatencyStats()
+
+    async def start(self, host = None, port = None, unix_socket = None):
+        ##start the workers before accepting connections, so the first requests don't wait for them
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, os.getpid) for _ in range(self.workers)])
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.create_task(self.batch_loop())
+        if unix_socket is not None:
+            return await asyncio.start_unix_server(self.handle_connection, path=unix_socket)
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    async def batch_loop(self):
+        """
+        Take the features waiting in the queue, score them in micro batches and give each request its part of the result
+        When the scoring fails, every request of the batch gets the exception
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self.queue.get()]
+            image_count = len(pending[0][0])
+            deadline = loop.time() + self.max_delay
+            while image_count < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+                image_count += len(pending[-1][0])
+
+            start = time.perf_counter()
+            try:
+                predictions, confidences = self.model.predict_batch(np.concatenate([features for features, _ in pending]))
+            except Exception as error:
+                ##the requests of the batch get the error, the loop keeps serving the next ones
+                for _, future in pending:
+                    if not future.cancelled():
+                        future.set_exception(error)
+                continue
+            model_time = time.perf_counter() - start
+            self.stats.batches += 1
+
+            first = 0
+            for features, future in pending:
+                if not future.cancelled():
+                    future.set_result((predictions[first:first + len(features)], confidences[first:first + len(features)], start, model_time))
+                first += len(features)
+
+    async def predict(self, images):
+        """
+        Score a list of images (bytes of the image files)
+        Output: predictions, confidences, latency of each stage
+        """
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        features = await loop.run_in_executor(self.executor, extract_features_from_bytes, images)
+        extracted = time.perf_counter()
+
+        future = loop.create_future()
+        await self.queue.put((features, future))
+        predictions, confidences, model_start, model_time = await future
+
+        timings = {"extract" : extracted - start, "queue" : model_start - extracted, "model" : model_time}
+        self.stats.images += len(images)
+        return predictions, confidences, timings
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except ValueError as error:
+                    ##malformed request line or headers, where the next request starts is unknown so the connection is closed
+                    write_response(writer, 400, {"error" : f"malformed request: {error}"}, False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, path, headers, body, read_time = request
+                status, response = await self.handle_request(method, path, headers, body, read_time)
+                keep_alive = headers.get("connection", "keep-alive").lower() != "close"
+                write_response(writer, status, response, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, method, path, headers, body, read_time):
+        start = time.perf_counter()
+        if method == "GET" and path == "/stats":
+            return 200, self.stats.summary()
+        if method != "POST" or path != "/predict":
+            return 404, {"error" : f"unknown request {method} {path}"}
+
+        try:
+            if headers.get("content-type", "").startswith("application/json"):
+                request = json.loads(body)
+                if "paths" in request:
+                    ##the files are read on a thread, so the other connections aren't held back by the disk
+                    images = await asyncio.get_running_loop().run_in_executor(None, read_files, request["paths"])
+                else:
+                    images = [base64.b64decode(image) for image in request["images"]]
+            else:
+                images = [body]
+            if len(images) == 0:
+                return 400, {"error" : "no image"}
+            predictions, confidences, timings = await self.predict(images)
+        except Exception as error:
+            return 400, {"error" : str(error)}
+
+        timings["read"] = read_time
+        timings["total"] = read_time + time.perf_counter() - start
+        self.stats.requests += 1
+        self.stats.add(timings)
+        return 200, {"predictions" : [{"char" : label_to_char(prediction), "label" : int(prediction), "confidence" : float(confidence)}
+                                      for prediction, confidence in zip(predictions, confidences)],
+                     "timings_ms" : {stage : latency * 1000 for stage, latency in timings.items()}}
+
+def read_files(filenames):
+    images = []
+    for image_filename in filenames:
+        with open(image_filename, "rb") as image_file:
+            images.append(image_file.read())
+    return images
+
+async def read_request(reader):
+    """
+    Read one HTTP request
+    Output: method, path, headers (lower case names), body, time spent reading, or None when the connection is closed
+    Raises ValueError when the request is malformed
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    start = time.perf_counter()
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, value = line.decode("latin-1").split(":", 1)
+        headers[name.strip().lower()] = value.strip()
+
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return method, path, headers, body, time.perf_counter() - start
+
+def write_response(writer, status, response, keep_alive):
+    body = json.dumps(response).encode()
+    reason = {200 : "OK", 400 : "Bad Request", 404 : "Not Found"}[status]
+    writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body)
+
+async def serve(model_file, host, port, unix_socket, workers, max_batch_size, max_delay):
+    server = InferenceServer(load_model(model_file), workers, max_batch_size, max_delay)
+    listener = await server.start(host, port, unix_socket)
+    print(f"Serving {model_file} on {unix_socket or f'http://{host}:{port}'}")
+    async with listener:
+        await listener.serve_forever()
+
+
+if __name__ == "__main__":
+    model_name = "char_recognition"
+    parser = argparse.ArgumentParser(description = "Serve the character recognition model over HTTP")
+    parser.add_argument("--model", default = f"{model_name}.npy" if os.path.exists(f"{model_name}.npy") else f"{model_name}.json")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8000)
+    parser.add_argument("--unix-socket", default = None, help = "listen on this unix socket instead of a TCP port")
+    parser.add_argument("--workers", type = int, default = None, help = "number of processes extracting the features (all the cores by default)")
+    parser.add_argument("--max-batch-size", type = int, default = MAX_BATCH_SIZE)
+    parser.add_argument("--max-delay-ms", type = float, default = MAX_DELAY * 1000, help = "time a request waits for others to join its micro batch")
+    args = parser.parse_args()
+
+    asyncio.run(serve(args.model, args.host, args.port, args.unix_socket, args.workers, args.max_batch_size, args.max_delay_ms / 1000))
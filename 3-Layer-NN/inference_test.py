@@ -1,26 +1,79 @@
 import os
 import json
 from utils import *
-from feature_extractor import feature_extractor
+from feature_cache import extract_features_cached
+from itertools import islice
 import numpy as np
 from neural_net import NeuralNet
-import sys
+from quantize_model import is_quantized, load_quantized_model
+import argparse
 
-def test_data(model, test_file):
+BATCH_SIZE = 256 ##number of images scored by the network at once
+
+def list_images(images):
+    """
+    images is a directory, a single image or a list of images (and directories), gives back the list of image filenames
+    """
+    if isinstance(images, str):
+        images = [images]
+    image_filenames = []
+    for image in images:
+        if os.path.isdir(image):
+            image_filenames.extend(os.path.join(image, image_file) for image_file in os.listdir(image))
+        else:
+            image_filenames.append(image)
+    return image_filenames
+
+def predict_images(model, images, batch_size = BATCH_SIZE, workers = None, use_cache = True):
+    """
+    Generator of (image filename, prediction, confidence) for every image, the features of batch_size images
+    are stacked into one matrix and scored with a single call to the network
+    The features are extracted by a pool of worker processes (or read from the feature cache), a batch is scored as soon as its images are done
+    """
+    image_filenames = list_images(images)
+    image_features = extract_features_cached(image_filenames, workers, use_cache)
+    for start in range(0, len(image_filenames), batch_size):
+        batch_filenames = image_filenames[start:start + batch_size]
+        features = np.array(list(islice(image_features, len(batch_filenames))))
+        predictions, confidences = model.predict_batch(features)
+        yield from zip(batch_filenames, predictions, confidences)
+
+def test_data(model, test_file, batch_size = BATCH_SIZE, workers = None, use_cache = True):
     correct_prediction = 0
     total_images = 0
     correct_images = []
-    ##process the test file
-    for image_file in os.listdir(test_file):
+    ##process the test file (a directory or a list of images), batch by batch
+    for relative_filename, prediction, confidence in predict_images(model, test_file, batch_size, workers, use_cache):
         total_images += 1 ##count the number of test files
-        relative_filename = os.path.join(test_file, image_file)
-        prediction, confidence = model.predict(feature_extractor(relative_filename))
+        image_file = os.path.basename(relative_filename)
         if prediction == extract_label(image_file):
             correct_prediction += 1
             correct_images.append((image_file, confidence))
     return (correct_prediction / total_images), correct_images ##accuracy = correct classification / all classification (for multiclass labelling)
 
-def load_model(json_file):
+def load_model(model_file):
+    """
+    Load a model saved by NeuralNet.saving_model, the arrays are memory mapped so nothing is read until they are used
+    (they are read only, copy them to train the model further)
+    A .json model saved by NeuralNet.saving_weights_bias is loaded with load_json_model, and a model saved by quantize_model.quantize_model
+    gives a QuantizedNeuralNet
+    """
+    if model_file.endswith(".json"):
+        return load_json_model(model_file)
+
+    model_parameter = np.load(model_file, mmap_mode="r")
+    if is_quantized(model_parameter):
+        return load_quantized_model(model_parameter)
+    input_hidden_weight = model_parameter["input_hidden_weight"][0]
+    hidden_output_weight = model_parameter["hidden_output_weight"][0]
+    hidden_bias = model_parameter["hidden_bias"][0]
+    output_bias = model_parameter["output_bias"][0]
+    model = NeuralNet(input_hidden_weight.shape[1], input_hidden_weight.shape[0], hidden_output_weight.shape[0], float(model_parameter["learning_rate"][0]))
+    model.load_weight_bias(input_hidden_weight, hidden_output_weight, hidden_bias, output_bias)
+
+    return model
+
+def load_json_model(json_file):
     with open(json_file, "r") as model_file:
         model_parameter = json.loads(model_file.read())
         input_neurons = model_parameter["input_neurons"] 
@@ -36,16 +89,35 @@ def load_model(json_file):
 
     return model
 
-def model_inference(model, image):
-    prediction = model.predict(feature_extractor(image))[0] ##don't need the confidence here
+def model_inference(model, image, use_cache = True):
+    prediction = model.predict(next(extract_features_cached([image], 1, use_cache)))[0] ##don't need the confidence here
     return label_to_char(prediction)
-    
+
+def model_inference_batch(model, images, batch_size = BATCH_SIZE, workers = None, use_cache = True):
+    """
+    model_inference for a directory or a list of images, gives back a list of (image filename, character)
+    """
+    return [(image_filename, label_to_char(prediction)) for image_filename, prediction, _ in predict_images(model, images, batch_size, workers, use_cache)]
+
 
 if __name__ == "__main__":
     model_name = "char_recognition"
-    model = load_model(f"{model_name}.json")
-    image_filename = sys.argv[1]
-    print(model_inference(model,image_filename))
+    model_file = f"{model_name}.npy" if os.path.exists(f"{model_name}.npy") else f"{model_name}.json"
+    parser = argparse.ArgumentParser(description = "Recognise the character in each image")
+    parser.add_argument("images", nargs = "+", help = "image filenames or directories of images")
+    parser.add_argument("--model", default = model_file, help = "model saved as .npy (or .json)")
+    parser.add_argument("--batch-size", type = int, default = BATCH_SIZE)
+    parser.add_argument("--workers", type = int, default = None, help = "number of processes extracting the features (all the cores by default)")
+    parser.add_argument("--no-cache", action = "store_true", help = "always extract the features instead of reading them from the feature cache")
+    parser.add_argument("--test", action = "store_true", help = "print the accuracy instead, the label is the first character of each filename")
+    args = parser.parse_args()
 
-    ############# testing the model #############
-    #print(test_data(load_model(f"{model_name}.json"), "Dataset/Test"))
\ No newline at end of file
+    model = load_model(args.model)
+    if args.test:
+        ############# testing the model #############
+        print(test_data(model, args.images, args.batch_size, args.workers, not args.no_cache)[0])
+    elif len(args.images) == 1 and not os.path.isdir(args.images[0]):
+        print(model_inference(model, args.images[0], not args.no_cache))
+    else:
+        for image_filename, char in model_inference_batch(model, args.images, args.batch_size, args.workers, not args.no_cache):
+            print(f"{image_filename}: {char}")
@@ -2,19 +2,25 @@ import numpy as np
 import math
 import json
 import os
+import argparse
+import time
 from utils import extract_label
-from feature_extractor import feature_extractor
+from feature_cache import extract_features_cached
+from optimizers import SGD, make_optimizer, make_schedule
+from profiling import StageProfiler, NULL_STAGE
 
 seed = 7 ##to allow replication of weights
 np.random.seed(seed) ##setting up seed
 
 class NeuralNet():
-    def __init__(self, input_neurons, hidden_neurons, output_neurons, learning_rate):
+    def __init__(self, input_neurons, hidden_neurons, output_neurons, learning_rate, verbose = False):
         self.image_inputs = None
         self.image_targets = None
         self.learning_rate = learning_rate
         self.max_iteration = 1000
         self.iteration = 0
+        self.verbose = verbose ##print the error while training
+        self.profiler = None ##StageProfiler timing each stage, see enable_profiling
 
         ##weight and bias initialization
         self.input_hidden_weight = np.random.uniform(-0.5,0.5,size =(hidden_neurons, input_neurons))
@@ -23,8 +29,9 @@ class NeuralNet():
         self.output_bias = np.random.uniform(0, 1, size=(output_neurons, 1))
     
     def update_training_data(self, image_inputs, image_targets):
-        self.image_inputs = image_inputs
-        self.image_targets = image_targets
+        ##kept as arrays so that the whole batch goes through the network at once
+        self.image_inputs = np.asarray(image_inputs, dtype=float)
+        self.image_targets = np.asarray(image_targets)
         self.iteration = 0
 
     def load_model(self, input_hidden_weight, hidden_output_weight, hidden_bias, output_bias):
@@ -33,22 +40,29 @@ class NeuralNet():
         self.hidden_bias = hidden_bias
         self.output_bias = output_bias
 
+    def enable_profiling(self):
+        ##time and count forward_nn, the backward pass, the updates and check_for_end, see profile_report
+        self.profiler = StageProfiler()
+        return self.profiler
+
+    def profile(self, stage, samples = 1):
+        return self.profiler.stage(stage, samples) if self.profiler is not None else NULL_STAGE
+
+    def profile_report(self):
+        return self.profiler.report() if self.profiler is not None else {}
+
+    def dump_profile(self, filename):
+        self.profiler.dump_json(filename)
+
     def forward_input_hidden(self, image_input):
-        hidden_layer_result =  np.zeros(len(self.input_hidden_weight))
-        for index, input_weight in enumerate(self.input_hidden_weight):
-            hidden_layer_result[index] = self.forward(image_input, input_weight, self.hidden_bias[index][0])
-        
-        return hidden_layer_result
+        ##image_input is a single image (features,) or a batch (N, features), each row of the weight is one hidden neuron
+        return self.forward(image_input, self.input_hidden_weight, self.hidden_bias[:, 0])
 
     def forward_hidden_output(self, hidden_layer_result):
-        output_layer_result = np.zeros(len(self.hidden_output_weight))
-        for index, hidden_weight in enumerate(self.hidden_output_weight):
-            output_layer_result[index] = self.forward(hidden_layer_result, hidden_weight, self.output_bias[index][0])
-        
-        return output_layer_result
+        return self.forward(hidden_layer_result, self.hidden_output_weight, self.output_bias[:, 0])
         
     def forward(self, inputs, weights, bias):
-        return self.sigmoid(np.dot(inputs,weights) + bias)
+        return self.sigmoid(np.dot(inputs, weights.T) + bias)
 
     def RELU(self, inputs):
         return max(0,inputs)
@@ -57,97 +71,82 @@ class NeuralNet():
         return 1/(1+np.exp(-inputs))
     
     def forward_nn(self, image_input):
-        hidden_layer_result = self.forward_input_hidden(image_input)
-        output_layer_result = self.forward_hidden_output(hidden_layer_result)
+        with self.profile("forward_nn", len(image_input) if np.ndim(image_input) > 1 else 1):
+            hidden_layer_result = self.forward_input_hidden(image_input)
+            output_layer_result = self.forward_hidden_output(hidden_layer_result)
         return hidden_layer_result, output_layer_result
 
+    def target_matrix(self, image_targets):
+        ##one hot encoding of the targets, one row per item in the batch
+        return np.eye(self.hidden_output_weight.shape[0])[image_targets]
+
     def check_for_end(self, neuron_outputs):
         to_end = True
         
-        total_error = 0
-
-        ##for each item in the batch, find the error
-        for i in range(len(self.image_targets)):
-            ##calculate error based on the image target
-            for j, output in enumerate(neuron_outputs[i][1]):
-                error = 0.5*(output - (0 if j != self.image_targets[i] else 1))**2
-                total_error += error
+        ##for each item in the batch, find the error based on the image target
+        output_layer_result = neuron_outputs[1]
+        total_error = np.sum(0.5 * (output_layer_result - self.target_matrix(self.image_targets))**2)
         
-        average_error = total_error / len(neuron_outputs)
+        average_error = total_error / len(output_layer_result)
         if average_error > 0.05 and self.iteration < self.max_iteration:
             to_end = False
         
 
-        print(f"Average error after {self.iteration} backward propagation: {average_error}")
+        if self.verbose:
+            print(f"Average error after {self.iteration} backward propagation: {average_error}")
         self.iteration += 1
         
         return to_end
     
-    def weight_bias_correction_output(self, hidden_layer_result, output_layer_result, image_target):
-        ##output should be 2d matrix, where each row represent the weight for each output neuron
-        weight_changes = np.zeros(self.hidden_output_weight.shape)
-        bias_changes = np.zeros(self.output_bias.shape)
-        ##go through the weight from hidden node to output node
-        for row in range(self.hidden_output_weight.shape[0]): ##updating the incoming weights for each output node
-            output_k = output_layer_result[row]
-            target = (0 if row != image_target else 1)
-            delta_k = (output_k - target) * (output_k * (1-output_k))
-            bias_changes[row] = delta_k
-            for col in range(self.hidden_output_weight.shape[1]):
-                output_j = hidden_layer_result[col]
-                weight_changes[row][col] = delta_k * output_j
-
-        return weight_changes, bias_changes
-
-    def weight_bias_correction_hidden(self, hidden_layer_result, output_bias_changes, image_input):
+    def weight_bias_correction_output(self, hidden_layer_result, output_layer_result, image_targets):
         ##output should be 2d matrix, where each row represent the weight for each output neuron
-        weight_changes = np.zeros(self.input_hidden_weight.shape)
-        bias_changes = np.zeros(self.hidden_bias.shape)
+        ##delta_k has one row per item in the batch, the weight changes are the average of the outer products delta_k * output_j
+        delta_k = (output_layer_result - self.target_matrix(image_targets)) * (output_layer_result * (1 - output_layer_result))
+        weight_changes = np.dot(delta_k.T, hidden_layer_result) / len(delta_k)
+        bias_changes = delta_k.mean(axis=0)[:, np.newaxis]
 
-        ##go through the weight from input to hidden node
-        for row in range(self.input_hidden_weight.shape[0]):
-            output_j = hidden_layer_result[row]
-            delta_j = (output_j * (1-output_j)) * sum(self.hidden_output_weight[i][row] * output_bias_changes[i] for i in range(self.hidden_output_weight.shape[0]))
-            bias_changes[row] = delta_j
-            for col in range(self.input_hidden_weight.shape[1]):
-                weight_changes[row][col] = image_input[col] * delta_j
+        return weight_changes, bias_changes, delta_k
 
+    def weight_bias_correction_hidden(self, hidden_layer_result, delta_k, image_inputs):
+        ##output should be 2d matrix, where each row represent the weight for each hidden neuron
+        delta_j = (hidden_layer_result * (1 - hidden_layer_result)) * np.dot(delta_k, self.hidden_output_weight)
+        weight_changes = np.dot(delta_j.T, image_inputs) / len(delta_j)
+        bias_changes = delta_j.mean(axis=0)[:, np.newaxis]
 
         return weight_changes, bias_changes
     
+    def parameters(self):
+        ##every weight and bias, in the same order as the gradients
+        return [self.input_hidden_weight, self.hidden_bias, self.hidden_output_weight, self.output_bias]
+
+    def gradients(self, image_inputs, image_targets):
+        ##weight and bias changes averaged over a mini batch, in the same order as parameters
+        hidden_layer_result, output_layer_result = self.forward_nn(image_inputs)
+        with self.profile("backward", len(image_inputs)):
+            hidden_weight_changes, output_bias_changes, delta_k = self.weight_bias_correction_output(hidden_layer_result, output_layer_result, image_targets)
+            input_weight_changes, hidden_bias_changes = self.weight_bias_correction_hidden(hidden_layer_result, delta_k, image_inputs)
+        return [input_weight_changes, hidden_bias_changes, hidden_weight_changes, output_bias_changes]
+
+    def evaluate(self, image_inputs, image_targets):
+        ##average error (same as check_for_end) and accuracy
+        output_layer_result = self.forward_nn(image_inputs)[1]
+        average_error = np.sum(0.5 * (output_layer_result - self.target_matrix(image_targets))**2) / len(output_layer_result)
+        accuracy = np.mean(np.argmax(output_layer_result, axis=1) == image_targets)
+        return average_error, accuracy
+
     def weight_bias_update(self, neuron_outputs):
-        aggregated_hidden_weight_changes = np.zeros(self.hidden_output_weight.shape)
-        aggregated_output_bias_changes = np.zeros(self.output_bias.shape)
-        aggregated_input_weight_changes = np.zeros(self.input_hidden_weight.shape)
-        aggregated_hidden_bias_changes = np.zeros(self.hidden_bias.shape)
-        
-        ##go through each hidden layer and output layer result for each item in the batch
-        for i in range(len(neuron_outputs)):
-            hidden_weight_changes, output_bias_changes = self.weight_bias_correction_output(neuron_outputs[i][0], neuron_outputs[i][1], self.image_targets[i])
-            input_weight_changes, hidden_bias_changes = self.weight_bias_correction_hidden(neuron_outputs[i][0],output_bias_changes, self.image_inputs[i])
-            aggregated_hidden_weight_changes += hidden_weight_changes
-            aggregated_output_bias_changes += output_bias_changes
-            aggregated_input_weight_changes += input_weight_changes
-            aggregated_hidden_bias_changes += hidden_bias_changes
-        
-        ##find the average weight and bias changes
-        aggregated_hidden_weight_changes /= len(neuron_outputs)
-        aggregated_output_bias_changes /= len(neuron_outputs)
-        aggregated_input_weight_changes /= len(neuron_outputs)
-        aggregated_hidden_bias_changes /= len(neuron_outputs)
-            
+        ##the whole batch goes through at once, the changes are already averaged over the batch
+        hidden_layer_result, output_layer_result = neuron_outputs
+        hidden_weight_changes, output_bias_changes, delta_k = self.weight_bias_correction_output(hidden_layer_result, output_layer_result, self.image_targets)
+        input_weight_changes, hidden_bias_changes = self.weight_bias_correction_hidden(hidden_layer_result, delta_k, self.image_inputs)
 
         ##update weight and bias from hidden layer to output layer
-        for row in range(self.hidden_output_weight.shape[0]):
-            self.output_bias[row] = self.output_bias[row] - (self.learning_rate*aggregated_output_bias_changes[row])
-            for col in range(self.hidden_output_weight.shape[1]):
-                self.hidden_output_weight[row][col] = self.hidden_output_weight[row][col] - (self.learning_rate*aggregated_hidden_weight_changes[row][col])
+        self.output_bias -= self.learning_rate * output_bias_changes
+        self.hidden_output_weight -= self.learning_rate * hidden_weight_changes
         
         ##update weight and bias from input layer to hidden layer
-        for row in range(self.input_hidden_weight.shape[0]):
-            self.hidden_bias[row] = self.hidden_bias[row] - (self.learning_rate*aggregated_hidden_bias_changes[row])
-            for col in range(self.input_hidden_weight.shape[1]):
-                self.input_hidden_weight[row][col] = self.input_hidden_weight[row][col] - (self.learning_rate*aggregated_input_weight_changes[row][col])
+        self.hidden_bias -= self.learning_rate * hidden_bias_changes
+        self.input_hidden_weight -= self.learning_rate * input_weight_changes
 
 
     def saving_weights_bias(self, filename):
@@ -164,6 +163,19 @@ class NeuralNet():
         with open(filename, "w") as output:
             output.write(json.dumps(model_parameter, indent= 4))
         
+    def saving_model(self, filename, dtype = np.float64):
+        """
+        Save the model in the binary format (see model_dtype), which can be loaded back with np.load(mmap_mode="r")
+        """
+        model_parameter = np.zeros(1, dtype=model_dtype(self.input_hidden_weight.shape[1], self.input_hidden_weight.shape[0], self.hidden_output_weight.shape[0], dtype))
+        model_parameter["learning_rate"] = self.learning_rate
+        model_parameter["input_hidden_weight"] = self.input_hidden_weight
+        model_parameter["hidden_output_weight"] = self.hidden_output_weight
+        model_parameter["hidden_bias"] = self.hidden_bias
+        model_parameter["output_bias"] = self.output_bias
+
+        np.save(filename, model_parameter)
+
     def load_weight_bias(self, input_hidden_weight, hidden_output_weight, hidden_bias, output_bias):
         self.input_hidden_weight = input_hidden_weight
         self.hidden_output_weight = hidden_output_weight
@@ -174,15 +186,75 @@ class NeuralNet():
     def train(self):
         done_training = False
         while not done_training:
-            neuron_outputs = []
-            for index in range(len(self.image_inputs)):
-                ##train on the batch data
-                neuron_outputs.append(self.forward_nn(self.image_inputs[index]))
-            if not self.check_for_end(neuron_outputs):
-                self.weight_bias_update(neuron_outputs)
+            ##train on the batch data, one matrix product per layer
+            neuron_outputs = self.forward_nn(self.image_inputs)
+            with self.profile("check_for_end", len(self.image_inputs)):
+                to_end = self.check_for_end(neuron_outputs)
+            if not to_end:
+                with self.profile("weight_bias_update", len(self.image_inputs)):
+                    self.weight_bias_update(neuron_outputs)
             else:
                 done_training = True
     
+    def fit(self, image_inputs, image_targets, optimizer = None, batch_size = 8, epochs = 500, shuffle = True,
+            validation_split = 0.2, patience = 50, schedule = None):
+        """
+        Mini batch training, train() is the full batch version
+        optimizer is one of optimizers.py (gradient descent with self.learning_rate by default), schedule gives the factor of the
+        learning rate at each epoch. A validation_split of the data is held out, and the training stops when the validation error
+        hasn't improved for patience epochs, the weights of the best epoch are then restored
+        Output: list of (epoch, training error, validation error, validation accuracy)
+        """
+        image_inputs = np.asarray(image_inputs, dtype=float)
+        image_targets = np.asarray(image_targets)
+        optimizer = optimizer or SGD(self.learning_rate)
+
+        ##hold out the validation data, picked with the seeded random generator so it is always the same
+        order = np.random.permutation(len(image_inputs))
+        validation_count = int(len(image_inputs) * validation_split)
+        validation_inputs, validation_targets = image_inputs[order[:validation_count]], image_targets[order[:validation_count]]
+        training_inputs, training_targets = image_inputs[order[validation_count:]], image_targets[order[validation_count:]]
+
+        history = []
+        best_error = math.inf
+        best_parameters = None
+        epochs_without_improvement = 0
+        for epoch in range(epochs):
+            epoch_start = time.perf_counter()
+            learning_rate_factor = schedule(epoch) if schedule is not None else 1.0
+            training_order = np.random.permutation(len(training_inputs)) if shuffle else np.arange(len(training_inputs))
+            for start in range(0, len(training_order), batch_size):
+                batch = training_order[start:start + batch_size]
+                gradients = self.gradients(training_inputs[batch], training_targets[batch])
+                with self.profile("optimizer_step", len(batch)):
+                    optimizer.step(self.parameters(), gradients, learning_rate_factor)
+
+            training_error = self.evaluate(training_inputs, training_targets)[0]
+            if validation_count > 0:
+                validation_error, validation_accuracy = self.evaluate(validation_inputs, validation_targets)
+            else:
+                validation_error, validation_accuracy = training_error, None
+            history.append((epoch, training_error, validation_error, validation_accuracy))
+            if self.profiler is not None:
+                self.profiler.add("epoch", time.perf_counter() - epoch_start, len(training_inputs))
+            if self.verbose:
+                print(f"Epoch {epoch}: training error {training_error}, validation error {validation_error}, validation accuracy {validation_accuracy}")
+
+            ##early stopping
+            if validation_error < best_error:
+                best_error = validation_error
+                best_parameters = [parameter.copy() for parameter in self.parameters()]
+                epochs_without_improvement = 0
+            else:
+                epochs_without_improvement += 1
+                if epochs_without_improvement >= patience:
+                    break
+
+        if best_parameters is not None:
+            for parameter, best_parameter in zip(self.parameters(), best_parameters):
+                parameter[...] = best_parameter
+        return history
+
     def softmax(self,x):
         return(np.exp(x - np.max(x)) / np.exp(x - np.max(x)).sum())
 
@@ -191,33 +263,70 @@ class NeuralNet():
         result = np.argmax(self.softmax(logits))
         return result, logits[result]  ##to get the confidence
 
+    def predict_batch(self, image_inputs):
+        """
+        Same as predict for a whole (N, features) matrix at once
+        The softmax doesn't change the argmax, so it is skipped, the confidence is the output of the chosen neuron like in predict
+        """
+        logits = self.forward_nn(np.asarray(image_inputs, dtype=float))[1]
+        results = np.argmax(logits, axis=1)
+        return results, logits[np.arange(len(logits)), results]
 
 
 
-def data_processing(training_file):
+
+def model_dtype(input_neurons, hidden_neurons, output_neurons, dtype = np.float64):
+    """
+    Layout of the binary model file, a .npy file holding a single record with every array of the model
+    The shapes are saved in the .npy header, and the arrays are contiguous after it so they can be memory mapped as they are
+    """
+    return np.dtype([("learning_rate", np.float64),
+                     ("input_hidden_weight", dtype, (hidden_neurons, input_neurons)),
+                     ("hidden_output_weight", dtype, (output_neurons, hidden_neurons)),
+                     ("hidden_bias", dtype, (hidden_neurons, 1)),
+                     ("output_bias", dtype, (output_neurons, 1))])
+
+
+def data_processing(training_file, workers = None, use_cache = True):
     """
     This function used to prepare training dataset, where we extract features of the images and mark them with their labels
     I also chose to seperate the training dataset into batches
+    The features are extracted by a pool of worker processes, they come back in the order of the files so the batches are always the same
+    Features already in the feature cache are read from it instead
     """
     data_batches = [None] * 4 ##train with 4 data batches
     for i in range(len(data_batches)):
         data_batches[i] = ([],[])
 
     ##loop through the training file
-    for image_file in os.listdir(training_file):
-        relative_filename = os.path.join(training_file, image_file)
+    image_files = os.listdir(training_file)
+    features = extract_features_cached([os.path.join(training_file, image_file) for image_file in image_files], workers, use_cache)
+    for image_file, image_features in zip(image_files, features):
         file_ord_value = ord(image_file[0])
         if file_ord_value >= 50 and file_ord_value <= 56:
             bin_to_insert = data_batches[(ord(image_file[1]) - 97)//2]
         else:
             bin_to_insert = data_batches[(((int(image_file[1]) + 1)// 2) - 1)] ##process each image into their respective data batch
-        bin_to_insert[0].append(feature_extractor(relative_filename))
+        bin_to_insert[0].append(image_features)
         bin_to_insert[1].append(extract_label(image_file))
     
     return data_batches
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Train the character recognition model")
+    parser.add_argument("--optimizer", default = "gd", choices = ["gd", "sgd", "momentum", "adam"],
+                        help = "gd is the full batch gradient descent on each of the 4 data batches, the others train on mini batches")
+    parser.add_argument("--learning-rate", type = float, default = None, help = "0.5 by default, 0.05 for momentum and 0.03 for adam")
+    parser.add_argument("--batch-size", type = int, default = 8)
+    parser.add_argument("--epochs", type = int, default = 500)
+    parser.add_argument("--schedule", default = "constant", choices = ["constant", "step", "exponential", "cosine"])
+    parser.add_argument("--validation-split", type = float, default = 0.2)
+    parser.add_argument("--patience", type = int, default = 50, help = "epochs without improvement of the validation error before stopping")
+    parser.add_argument("--no-shuffle", action = "store_true")
+    parser.add_argument("--verbose", action = "store_true", help = "print the error after every iteration or epoch")
+    args = parser.parse_args()
+
     ############ training the model ############
     training_file = "Dataset/Train"
     model_name = "char_recognition"
@@ -225,20 +334,32 @@ if __name__ == "__main__":
     input_nodes = len(data_batches[0][0][0]) ##get the size of flatten array for the first image
     output_nodes = 15
     hidden_nodes = int((math.sqrt(input_nodes * output_nodes) // 10) * 10)
+    learning_rate = args.learning_rate or {"gd" : 0.5, "sgd" : 0.5, "momentum" : 0.05, "adam" : 0.03}[args.optimizer]
     print(f"Commence training\nInput nodes: {input_nodes}, Hidden Nodes : {hidden_nodes}")
-    network = NeuralNet(input_nodes, hidden_nodes, output_nodes, 0.5)
+    network = NeuralNet(input_nodes, hidden_nodes, output_nodes, learning_rate, args.verbose)
+    training_input = [image_features for data_batch in data_batches for image_features in data_batch[0]]
+    training_target = [image_target for data_batch in data_batches for image_target in data_batch[1]]
+    untrained_accuracy = network.evaluate(np.asarray(training_input), np.asarray(training_target))[1]
     
     #train the network 
-    count_batch = 1
-    for data_batch in data_batches:
-        print(f"\nProcessing Data Batch {count_batch}\n")
-        count_batch += 1
-        training_input = data_batch[0]
-        training_target = data_batch[1]
-        network.update_training_data(training_input, training_target)
-        network.train()
-    
-    network.saving_weights_bias(f"{model_name}.json")
-
+    if args.optimizer == "gd":
+        count_batch = 1
+        for data_batch in data_batches:
+            print(f"\nProcessing Data Batch {count_batch}\n")
+            count_batch += 1
+            network.update_training_data(data_batch[0], data_batch[1])
+            network.train()
+    else:
+        history = network.fit(training_input, training_target, make_optimizer(args.optimizer, learning_rate), args.batch_size, args.epochs,
+                              not args.no_shuffle, args.validation_split, args.patience, make_schedule(args.schedule, args.epochs))
+        print(f"Trained for {len(history)} epochs, best validation error {min(entry[2] for entry in history)}")
     
-    
\ No newline at end of file
+    ##a training that went wrong (e.g. a learning rate too high) must not replace the saved model, the accuracy is compared
+    ##rather than the error, a network giving 0 for every class has a lower error than the untrained one and is still useless
+    trained_accuracy = network.evaluate(np.asarray(training_input), np.asarray(training_target))[1]
+    if trained_accuracy <= untrained_accuracy:
+        print(f"The accuracy of the trained network ({trained_accuracy}) is no better than the untrained one ({untrained_accuracy}), {model_name}.npy is kept")
+    elif args.optimizer != "gd" and len(history) > 1 and min(history, key = lambda entry: entry[2])[0] == 0:
+        print(f"No epoch improved on the first one, the training failed (try a lower learning rate), {model_name}.npy is kept")
+    else:
+        network.saving_model(f"{model_name}.npy")
@@ -0,0 +1,89 @@
+import math
+import numpy as np
+
+class SGD():
+    """
+    Gradient descent on a mini batch, with momentum when momentum > 0
+    """
+    def __init__(self, learning_rate, momentum = 0.0):
+        self.learning_rate = learning_rate
+        self.momentum = momentum
+        self.velocities = None
+
+    def step(self, parameters, gradients, learning_rate_factor = 1.0):
+        """
+        Update each parameter array in place from its gradient, learning_rate_factor comes from the learning rate schedule
+        """
+        learning_rate = self.learning_rate * learning_rate_factor
+        if self.momentum == 0:
+            for parameter, gradient in zip(parameters, gradients):
+                parameter -= learning_rate * gradient
+            return
+
+        if self.velocities is None:
+            self.velocities = [np.zeros_like(parameter) for parameter in parameters]
+        for parameter, gradient, velocity in zip(parameters, gradients, self.velocities):
+            velocity *= self.momentum
+            velocity -= learning_rate * gradient
+            parameter += velocity
+
+class Adam():
+    """
+    Adam, the step of each weight is scaled by running averages of its gradient and of its squared gradient
+    """
+    def __init__(self, learning_rate = 0.01, beta1 = 0.9, beta2 = 0.999, epsilon = 1e-8):
+        self.learning_rate = learning_rate
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.first_moments = None
+        self.second_moments = None
+        self.steps = 0
+
+    def step(self, parameters, gradients, learning_rate_factor = 1.0):
+        if self.first_moments is None:
+            self.first_moments = [np.zeros_like(parameter) for parameter in parameters]
+            self.second_moments = [np.zeros_like(parameter) for parameter in parameters]
+        self.steps += 1
+
+        ##bias correction of the running averages, folded into the learning rate
+        learning_rate = self.learning_rate * learning_rate_factor * math.sqrt(1 - self.beta2 ** self.steps) / (1 - self.beta1 ** self.steps)
+        for parameter, gradient, first_moment, second_moment in zip(parameters, gradients, self.first_moments, self.second_moments):
+            first_moment *= self.beta1
+            first_moment += (1 - self.beta1) * gradient
+            second_moment *= self.beta2
+            second_moment += (1 - self.beta2) * gradient**2
+            parameter -= learning_rate * first_moment / (np.sqrt(second_moment) + self.epsilon)
+
+def make_optimizer(name, learning_rate, momentum = 0.9):
+    if name == "sgd":
+        return SGD(learning_rate)
+    elif name == "momentum":
+        return SGD(learning_rate, momentum)
+    elif name == "adam":
+        return Adam(learning_rate)
+    raise ValueError(f"Unknown optimizer {name}")
+
+##learning rate schedules, each one gives the factor applied to the learning rate at an epoch
+def constant_schedule():
+    return lambda epoch: 1.0
+
+def step_schedule(drop = 0.5, every = 20):
+    return lambda epoch: drop ** (epoch // every)
+
+def exponential_schedule(decay = 0.97):
+    return lambda epoch: decay ** epoch
+
+def cosine_schedule(epochs, minimum = 0.05):
+    return lambda epoch: minimum + (1 - minimum) * 0.5 * (1 + math.cos(math.pi * min(epoch, epochs) / epochs))
+
+def make_schedule(name, epochs):
+    if name == "constant":
+        return constant_schedule()
+    elif name == "step":
+        return step_schedule()
+    elif name == "exponential":
+        return exponential_schedule()
+    elif name == "cosine":
+        return cosine_schedule(epochs)
+    raise ValueError(f"Unknown learning rate schedule {name}")
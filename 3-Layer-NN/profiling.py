@@ -0,0 +1,41 @@
+import json
+import time
+from contextlib import contextmanager, nullcontext
+
+NULL_STAGE = nullcontext() ##used when profiling is off, so a disabled timer costs almost nothing
+
+class StageProfiler():
+    """
+    Time spent in each stage, how many times it ran and how many samples went through it
+    """
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name, samples = 1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, samples)
+
+    def add(self, name, seconds, samples = 1):
+        stage = self.stages.setdefault(name, {"calls" : 0, "samples" : 0, "seconds" : 0.0})
+        stage["calls"] += 1
+        stage["samples"] += samples
+        stage["seconds"] += seconds
+
+    def reset(self):
+        self.stages = {}
+
+    def report(self):
+        report = {}
+        for name, stage in self.stages.items():
+            report[name] = dict(stage)
+            report[name]["ms_per_call"] = stage["seconds"] * 1000 / stage["calls"]
+            report[name]["samples_per_second"] = stage["samples"] / stage["seconds"] if stage["seconds"] > 0 else None
+        return report
+
+    def dump_json(self, filename):
+        with open(filename, "w") as output:
+            output.write(json.dumps(self.report(), indent=4))
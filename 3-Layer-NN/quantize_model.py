@@ -0,0 +1,160 @@
+"""
+Export the model with its weights quantised to int8 (or float16), and compare it with the float model
+
+Each row of a weight matrix (the weights of one neuron) gets its own scale, the largest weight of the row is mapped to 127
+and the others are rounded to the nearest step, so a neuron with small weights keeps as much precision as one with big weights.
+The bias stays in float32. The int8 weights take 8 times less memory than the float64 ones, and the quantised model is scored in float32
+
+Example
+python quantize_model.py char_recognition.npy char_recognition_int8.npy --compare Dataset/Test
+python quantize_model.py char_recognition.npy char_recognition_fp16.npy --dtype float16
+"""
+import argparse
+import os
+import time
+import numpy as np
+from neural_net import NeuralNet
+from feature_cache import extract_features_cached
+from utils import extract_label
+
+COMPUTE_DTYPE = np.float32 ##the quantised models are scored in float32
+INT8_MAX = 127
+
+def quantize_rows(weight, dtype = np.int8):
+    """
+    Quantise each row of weight on its own
+    Output: quantised weight (dtype), scale of each row (float32) so that weight ~ quantised weight * scale[:, None]
+    float16 weights keep a scale of 1, the rounding error of float16 is already relative to each weight
+    """
+    weight = np.asarray(weight, dtype=np.float64)
+    if np.dtype(dtype) == np.float16:
+        return weight.astype(np.float16), np.ones(len(weight), dtype=np.float32)
+    if np.dtype(dtype) != np.int8:
+        raise ValueError(f"Unsupported quantisation type {np.dtype(dtype)}")
+
+    scale = np.abs(weight).max(axis=1) / INT8_MAX
+    scale[scale == 0] = 1 ##a row of zeros stays zeros
+    quantized_weight = np.clip(np.round(weight / scale[:, None]), -INT8_MAX, INT8_MAX).astype(np.int8)
+    return quantized_weight, scale.astype(np.float32)
+
+def quantized_model_dtype(input_neurons, hidden_neurons, output_neurons, dtype = np.int8):
+    """
+    Layout of the quantised model file, like neural_net.model_dtype with the scale of each row after each weight matrix
+    """
+    return np.dtype([("learning_rate", np.float64),
+                     ("input_hidden_weight", dtype, (hidden_neurons, input_neurons)),
+                     ("input_hidden_scale", np.float32, (hidden_neurons,)),
+                     ("hidden_output_weight", dtype, (output_neurons, hidden_neurons)),
+                     ("hidden_output_scale", np.float32, (output_neurons,)),
+                     ("hidden_bias", np.float32, (hidden_neurons, 1)),
+                     ("output_bias", np.float32, (output_neurons, 1))])
+
+class QuantizedNeuralNet(NeuralNet):
+    """
+    NeuralNet scoring with quantised weights, for inference only (predict, predict_batch, forward_nn)
+    The products are done in float32, numpy converts the quantised weights to a temporary float32 copy for each product, and each
+    output neuron is then multiplied by the scale of its row. Only the stored weights are small, the compute is the same as float32
+    It can't be trained (train and fit raise an Exception), train the float model and quantise it again
+    """
+    def __init__(self, input_hidden_weight, input_hidden_scale, hidden_output_weight, hidden_output_scale, hidden_bias, output_bias, learning_rate = 0.5):
+        super().__init__(input_hidden_weight.shape[1], input_hidden_weight.shape[0], hidden_output_weight.shape[0], learning_rate)
+        self.load_weight_bias(input_hidden_weight, hidden_output_weight, hidden_bias, output_bias)
+        self.input_hidden_scale = input_hidden_scale
+        self.hidden_output_scale = hidden_output_scale
+        ##the bias is added to every row of the batch, flattened once here
+        self.hidden_bias_row = np.asarray(hidden_bias[:, 0], dtype=COMPUTE_DTYPE)
+        self.output_bias_row = np.asarray(output_bias[:, 0], dtype=COMPUTE_DTYPE)
+
+    def forward_input_hidden(self, image_input):
+        return self.quantized_forward(image_input, self.input_hidden_weight, self.input_hidden_scale, self.hidden_bias_row)
+
+    def forward_hidden_output(self, hidden_layer_result):
+        return self.quantized_forward(hidden_layer_result, self.hidden_output_weight, self.hidden_output_scale, self.output_bias_row)
+
+    def quantized_forward(self, inputs, weights, scale, bias):
+        with np.errstate(over="ignore"): ##exp overflows sooner in float32, the sigmoid is still 0 there
+            return self.sigmoid(np.dot(np.asarray(inputs, dtype=COMPUTE_DTYPE), weights.T) * scale + bias)
+
+    def train(self):
+        raise Exception("A quantised model can't be trained, train the float model and quantise it again")
+
+    def fit(self, *args, **kwargs):
+        raise Exception("A quantised model can't be trained, train the float model and quantise it again")
+
+def quantize_model(model, filename, dtype = np.int8):
+    """
+    Save model (a NeuralNet) with its weights quantised to dtype (int8 or float16), see quantized_model_dtype
+    """
+    input_hidden_weight, input_hidden_scale = quantize_rows(model.input_hidden_weight, dtype)
+    hidden_output_weight, hidden_output_scale = quantize_rows(model.hidden_output_weight, dtype)
+    model_parameter = np.zeros(1, dtype=quantized_model_dtype(input_hidden_weight.shape[1], input_hidden_weight.shape[0], hidden_output_weight.shape[0], dtype))
+    model_parameter["learning_rate"] = model.learning_rate
+    model_parameter["input_hidden_weight"] = input_hidden_weight
+    model_parameter["input_hidden_scale"] = input_hidden_scale
+    model_parameter["hidden_output_weight"] = hidden_output_weight
+    model_parameter["hidden_output_scale"] = hidden_output_scale
+    model_parameter["hidden_bias"] = model.hidden_bias
+    model_parameter["output_bias"] = model.output_bias
+
+    np.save(filename, model_parameter)
+
+def is_quantized(model_parameter):
+    return "input_hidden_scale" in model_parameter.dtype.names
+
+def load_quantized_model(model_parameter):
+    """
+    QuantizedNeuralNet from the record of a quantised model file (loaded with np.load, memory mapped or not)
+    """
+    return QuantizedNeuralNet(model_parameter["input_hidden_weight"][0], model_parameter["input_hidden_scale"][0],
+                              model_parameter["hidden_output_weight"][0], model_parameter["hidden_output_scale"][0],
+                              model_parameter["hidden_bias"][0], model_parameter["output_bias"][0], float(model_parameter["learning_rate"][0]))
+
+def compare_models(float_model, quantized_model, images, workers = None, use_cache = True, batch_size = 4096, repeats = 20):
+    """
+    Score the labelled images (the label is the first character of each filename) with both models
+    Output: dict with the accuracy of each model, how many predictions they agree on, the largest difference between the confidences,
+    and the scoring speed of each model on a batch of batch_size images (the images are repeated to fill it)
+    """
+    from inference_test import list_images ##inference_test imports this module to load the quantised models
+
+    image_filenames = list_images(images)
+    labels = np.array([extract_label(os.path.basename(image_filename)) for image_filename in image_filenames])
+    features = np.array(list(extract_features_cached(image_filenames, workers, use_cache)))
+
+    float_predictions, float_confidences = float_model.predict_batch(features)
+    quantized_predictions, quantized_confidences = quantized_model.predict_batch(features)
+    comparison = {"images" : len(image_filenames),
+                  "float_accuracy" : float(np.mean(float_predictions == labels)),
+                  "quantized_accuracy" : float(np.mean(quantized_predictions == labels)),
+                  "agreement" : float(np.mean(float_predictions == quantized_predictions)),
+                  "max_confidence_difference" : float(np.max(np.abs(float_confidences - quantized_confidences)))}
+
+    batch = features[np.resize(np.arange(len(features)), batch_size)]
+    for name, model in (("float", float_model), ("quantized", quantized_model)):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model.predict_batch(batch)
+        comparison[f"{name}_samples_per_second"] = batch_size * repeats / (time.perf_counter() - start)
+    return comparison
+
+
+if __name__ == "__main__":
+    from inference_test import load_model
+
+    parser = argparse.ArgumentParser(description = "Quantise the weights of a model to int8 or float16")
+    parser.add_argument("model_file", nargs = "?", default = "char_recognition.npy", help = "float model saved as .npy (or .json)")
+    parser.add_argument("quantized_file", nargs = "?", default = "char_recognition_int8.npy")
+    parser.add_argument("--dtype", choices = ["int8", "float16"], default = "int8")
+    parser.add_argument("--compare", nargs = "?", const = "Dataset/Test", default = None, help = "labelled images (a directory, Dataset/Test by default) to compare the accuracy of both models on")
+    parser.add_argument("--workers", type = int, default = None, help = "number of processes extracting the features (all the cores by default)")
+    parser.add_argument("--no-cache", action = "store_true", help = "always extract the features instead of reading them from the feature cache")
+    args = parser.parse_args()
+
+    float_model = load_model(args.model_file)
+    quantize_model(float_model, args.quantized_file, np.dtype(args.dtype))
+    print(f"{args.quantized_file}: {os.path.getsize(args.quantized_file)} bytes ({args.model_file}: {os.path.getsize(args.model_file)} bytes)")
+
+    if args.compare is not None:
+        comparison = compare_models(float_model, load_model(args.quantized_file), args.compare, args.workers, not args.no_cache)
+        for name, value in comparison.items():
+            print(f"{name}: {value}")
@@ -0,0 +1,142 @@
+"""
+Export the ViT for CPU inference, with its Linear layers quantised to int8 and/or traced with TorchScript, and compare the backends
+
+The report gives, for each backend, how often its prediction of each label group agrees with the fp32 eager model, the largest
+difference of confidence, the accuracy of each label group when the sample is labelled, the latency of one image and the throughput
+of a batch
+
+Labels are a csv file with a header: filename, then one column per label group (LABEL_CATEGORY) holding the label name (e.g. Male)
+or its index in LABEL_NAMES, the filenames are relative to the sample directory
+
+Example
+python export_model.py --output vit_int8.pt
+python export_model.py --output vit_int8.pt --sample sample_crops --labels sample_crops/labels.csv
+python export_model.py --output vit_fp32.pt --no-quantize
+"""
+import argparse
+import csv
+import json
+import os
+import time
+import warnings
+import numpy as np
+import torch
+from postprocessing import LABEL_CATEGORY, LABEL_NAMES
+from preprocessing import ImagePreprocessor, IMAGE_SIZE
+from vision_transformer import ViTForUAVHuman, load_model, MODEL_ID, TOKEN, BATCH_SIZE
+
+REPEATS = 10 ##timed runs of the benchmark, the median is reported
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+class LogitsModel(torch.nn.Module):
+    """
+    The Hugging Face model taking the pixel values as its only argument and giving back the logits only, so it can be traced
+    """
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values=pixel_values).logits
+
+def export_torchscript(model, torchscript_file, batch_size = 2):
+    """
+    Trace the model (eager or int8) on a batch of batch_size images and save it, the traced model takes any batch size
+    """
+    example = torch.zeros((batch_size, 3, IMAGE_SIZE, IMAGE_SIZE))
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("ignore", torch.jit.TracerWarning) ##the shape checks of the model are fixed for 224 images, as they should be
+        traced = torch.jit.trace(LogitsModel(model).eval(), example)
+    torch.jit.save(traced, torchscript_file)
+
+def list_images(sample):
+    return [os.path.join(sample, image_file) for image_file in sorted(os.listdir(sample)) if image_file.lower().endswith(IMAGE_EXTENSIONS)]
+
+def load_labels(labels_file, sample):
+    """
+    Output: image filenames, (N, label groups) array of the label names
+    """
+    image_filenames = []
+    labels = []
+    with open(labels_file, newline="") as labels_csv:
+        for row in csv.DictReader(labels_csv):
+            image_filenames.append(os.path.join(sample, row["filename"]))
+            labels.append([LABEL_NAMES[int(row[category])] if row[category].isdigit() else row[category] for category in LABEL_CATEGORY])
+    return image_filenames, np.array(labels)
+
+def compare_predictions(reference_records, records, names, labels = None):
+    """
+    Agreement of records with reference_records (the fp32 eager predictions), and accuracy against labels when there are some
+    The names are compared rather than the label indices, as some names are there twice in a group (No Backpack, No Hat)
+    """
+    agreement = (reference_records.label == records.label).mean(axis=0)
+    comparison = {"agreement" : float(agreement.mean()),
+                  "agreement_per_group" : dict(zip(LABEL_CATEGORY, agreement.tolist())),
+                  "max_confidence_difference" : float(np.abs(reference_records.confidence - records.confidence).max())}
+    if labels is not None:
+        accuracy = (names == labels).mean(axis=0)
+        comparison["accuracy"] = float(accuracy.mean())
+        comparison["accuracy_per_group"] = dict(zip(LABEL_CATEGORY, accuracy.tolist()))
+    return comparison
+
+def benchmark(vit, pixel_values, repeats = REPEATS):
+    """
+    Median latency of one image and throughput of the whole pixel_values batch
+    """
+    vit.predict_pixels(pixel_values) ##warm up
+    latencies = []
+    batch_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        vit.predict_pixels(pixel_values[:1])
+        latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        vit.predict_pixels(pixel_values)
+        batch_times.append(time.perf_counter() - start)
+    return {"latency_ms" : float(np.median(latencies)) * 1000, "batch_size" : len(pixel_values),
+            "images_per_second" : len(pixel_values) / float(np.median(batch_times))}
+
+def compare_backends(backends, image_filenames, labels = None, batch_size = BATCH_SIZE, repeats = REPEATS):
+    """
+    backends maps a name to a ViTForUAVHuman, the first one is the reference (the fp32 eager model)
+    Output: report of each backend (see compare_predictions and benchmark)
+    """
+    report = {}
+    reference_records = None
+    pixel_values = ImagePreprocessor(batch_size).preprocess([image_filenames[index % len(image_filenames)] for index in range(batch_size)])
+    for name, vit in backends.items():
+        records = vit.model_inference_records(image_filenames, batch_size)
+        if reference_records is None:
+            reference_records = records
+        report[name] = compare_predictions(reference_records, records, vit.decoder.names(records), labels)
+        report[name].update(benchmark(vit, pixel_values, repeats))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Export the ViT quantised to int8 and/or traced with TorchScript, and compare it with the fp32 model")
+    parser.add_argument("--model-id", default = MODEL_ID, help = "hub id or local directory of the model")
+    parser.add_argument("--weights-file", default = None, help = "local .safetensors weights, memory mapped")
+    parser.add_argument("--output", default = None, help = "save the TorchScript model into this file")
+    parser.add_argument("--no-quantize", action = "store_true", help = "export the fp32 model instead of the int8 one")
+    parser.add_argument("--sample", default = None, help = "directory of images to compare the backends on")
+    parser.add_argument("--labels", default = None, help = "csv file of the labels of the sample images")
+    parser.add_argument("--batch-size", type = int, default = BATCH_SIZE)
+    parser.add_argument("--repeats", type = int, default = REPEATS)
+    args = parser.parse_args()
+
+    backend = "eager" if args.no_quantize else "int8"
+    if args.output is not None:
+        export_torchscript(load_model(args.model_id, TOKEN, args.weights_file, backend), args.output)
+        print(f"Saved the {backend} model traced with TorchScript into {args.output}")
+
+    if args.sample is not None:
+        if args.labels is not None:
+            image_filenames, labels = load_labels(args.labels, args.sample)
+        else:
+            image_filenames, labels = list_images(args.sample), None
+        backends = {"eager" : ViTForUAVHuman(args.model_id, weights_file = args.weights_file),
+                    "int8" : ViTForUAVHuman(args.model_id, weights_file = args.weights_file, backend = "int8")}
+        if args.output is not None:
+            backends[f"torchscript ({backend})"] = ViTForUAVHuman(args.model_id, backend = "torchscript", torchscript_file = args.output)
+        print(json.dumps(compare_backends(backends, image_filenames, labels, args.batch_size, args.repeats), indent=4))
@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 16 ##the hash has HASH_SIZE * HASH_SIZE bits, fewer bits match more crops of different people
+CACHE_SIZE = 4096 ##predictions kept in the cache
+CACHE_TTL = 60.0 ##seconds a prediction stays in the cache
+THUMBNAIL_SIZE = 32 ##side of the grey thumbnails compared by the frame skipping
+FRAME_DIFFERENCE = 4.0 ##mean absolute difference of the thumbnails (grey levels out of 255) under which a frame is skipped
+MAX_SKIP = 30 ##frames in a row that can reuse the same prediction, a frame is scored again after that even if nothing moved
+
+def grey_thumbnail(pixels, width, height):
+    return np.asarray(Image.fromarray(pixels).convert("L").resize((width, height), Image.BILINEAR), dtype=np.float32)
+
+def perceptual_hash(pixels, hash_size = HASH_SIZE):
+    """
+    Difference hash of a (height, width, 3) uint8 image: each bit says whether a pixel of the grey thumbnail is brighter than
+    its right neighbour, so the hash doesn't change with small changes of brightness, compression or scale
+    """
+    thumbnail = grey_thumbnail(pixels, hash_size + 1, hash_size)
+    return np.packbits(thumbnail[:, 1:] > thumbnail[:, :-1]).tobytes()
+
+class InferenceCache():
+    """
+    Predictions (records of AttributeDecoder.decode) keyed by the perceptual hash of the image
+    The least recently used prediction is dropped when the cache is full, and a prediction older than ttl seconds is never given back
+    It can be shared by several threads
+    """
+    def __init__(self, max_size = CACHE_SIZE, ttl = CACHE_TTL, clock = time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict() ##key -> (time added, record), the least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """
+        The record cached for key, or None
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.clock() - entry[0] > self.ttl:
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, record):
+        with self.lock:
+            self.entries[key] = (self.clock(), record)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"size" : len(self.entries), "hits" : self.hits, "misses" : self.misses, "hit_rate" : self.hits / lookups if lookups else 0.0,
+                "evictions" : self.evictions, "expirations" : self.expirations}
+
+class FrameSkipper():
+    """
+    Decide, frame by frame, whether the prediction of the last scored frame can be reused
+    A frame is skipped while its grey thumbnail differs from the one of the last scored frame by less than threshold, so slow
+    changes add up until the frame is scored again, and at most max_skip frames in a row are skipped
+    The frames have to come from the same sequence, in order
+    """
+    def __init__(self, threshold = FRAME_DIFFERENCE, max_skip = MAX_SKIP, thumbnail_size = THUMBNAIL_SIZE):
+        self.threshold = threshold
+        self.max_skip = max_skip
+        self.thumbnail_size = thumbnail_size
+        self.reference = None ##thumbnail of the last scored frame
+        self.skipped_in_a_row = 0
+        self.frames = 0
+        self.skipped = 0
+
+    def skip(self, pixels):
+        """
+        pixels is the (height, width, 3) uint8 frame
+        Output: True when the frame can reuse the last prediction, otherwise it becomes the new reference and has to be scored
+        """
+        self.frames += 1
+        thumbnail = grey_thumbnail(pixels, self.thumbnail_size, self.thumbnail_size)
+        if (self.reference is not None and self.skipped_in_a_row < self.max_skip
+                and np.abs(thumbnail - self.reference).mean() < self.threshold):
+            self.skipped_in_a_row += 1
+            self.skipped += 1
+            return True
+        self.reference = thumbnail
+        self.skipped_in_a_row = 0
+        return False
+
+    def reset(self):
+        self.reference = None
+        self.skipped_in_a_row = 0
+
+    def stats(self):
+        return {"frames" : self.frames, "skipped" : self.skipped, "skip_rate" : self.skipped / self.frames if self.frames else 0.0}
@@ -0,0 +1,64 @@
+import numpy as np
+
+OFFSET_ARRAY = [3,6,6,12,4,12,4] ##our dataset has 7 labels, number of classes of each label
+LABEL_CATEGORY = ["Gender", "Backpack", "Hat", "Upper Clothing Colour", "Upper Clothing Style", "Lower Clothing Colour", "Lower Clothing Style"]
+LABEL_NAMES = ["No Gender", "Male", "Female",
+               "No Backpack", "Red Backpack", "Black Backpack", "Green Backpack", "Yellow Backpack", "No Backpack",
+               "No Hat", "Red Hat", "Black Hat", "Yellow Hat", "White Hat", "No Hat",
+               "Upper Clothing None", "Upper Clothing Red", "Upper Clothing Black", "Upper Clothing Blue", "Upper Clothing Green", "Upper Clothing Multicolor", "Upper Clothing Grey", "Upper Clothing White", "Upper Clothing Yellow", "Upper Clothing DarkBrown", "Upper Clothing Purple", "Upper Clothing Pink",
+               "Upper Style None", "Upper Style Long", "Upper Style Short", "Upper Style Skirt",
+               "Lower Clothing None", "Lower Clothing Red", "Lower Clothing Black", "Lower Clothing Blue", "Lower Clothing Green", "Lower Clothing Multicolor", "Lower Clothing Grey", "Lower Clothing White", "Lower Clothing Yellow", "Lower Clothing DarkBrown", "Lower Clothing Purple", "Lower Clothing Pink",
+               "Lower Style None", "Lower Style Long", "Lower Style Short", "Lower Style Skirt"]
+
+class AttributeDecoder():
+    """
+    Turn the logits of the model into the selected label and confidence of each label group, for a whole batch at once
+
+    The confidence of a label is its probability divided by the total probability of its group, which is the softmax of
+    the logits of the group alone. The groups are padded to the same size so every group of every image goes through one
+    (N, groups, largest group) softmax and argmax, the padding gets a logit of -inf so it never counts
+    """
+    def __init__(self, offset_array = OFFSET_ARRAY, label_category = LABEL_CATEGORY, label_names = LABEL_NAMES):
+        self.label_category = np.array(label_category)
+        self.label_names = np.array(label_names)
+        self.group_starts = np.cumsum([0] + offset_array[:-1])
+        group_size = max(offset_array)
+
+        ##column of the logits read at each (group, position), the padding reads column 0 and is masked
+        positions = np.arange(group_size)
+        self.padding = positions[None, :] >= np.array(offset_array)[:, None]
+        self.gather_index = np.where(self.padding, 0, self.group_starts[:, None] + positions[None, :])
+
+        ##"category : name" of every label, so the strings of a batch are a single lookup
+        group_of_label = np.repeat(np.arange(len(offset_array)), offset_array)
+        self.result_strings = np.array([" : ".join([label_category[group], name]) for group, name in zip(group_of_label, label_names)])
+
+        self.dtype = np.dtype([("label", np.int16, (len(offset_array),)), ("confidence", np.float32, (len(offset_array),))])
+
+    def decode(self, logits):
+        """
+        logits is a (N, labels) array
+        Output: record array of N records, label is the selected label of each group and confidence its probability within the group
+        """
+        grouped_logits = np.where(self.padding, -np.inf, np.asarray(logits)[:, self.gather_index])
+        positions = grouped_logits.argmax(axis = 2)
+        ##the selected label has the largest logit, so its exp(logit - max) is 1 and its softmax is 1 / sum
+        max_logits = np.take_along_axis(grouped_logits, positions[:, :, None], axis = 2)
+        total = np.exp(grouped_logits - max_logits).sum(axis = 2)
+
+        records = np.empty(len(grouped_logits), dtype = self.dtype).view(np.recarray)
+        records.label = self.group_starts + positions
+        records.confidence = 1 / total
+        return records
+
+    def names(self, records):
+        """
+        (N, groups) array of the label name of each record
+        """
+        return self.label_names[records.label]
+
+    def results(self, records):
+        """
+        (N, groups) array of the "category : label name" strings of each record, the results of model_inference
+        """
+        return self.result_strings[records.label]
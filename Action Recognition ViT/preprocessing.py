@@ -0,0 +1,76 @@
+import io
+import os
+import numpy as np
+from PIL import Image
+
+##preprocessing of google/vit-base-patch16-224-in21k, the feature extractor the model was trained with
+IMAGE_SIZE = 224
+IMAGE_MEAN = [0.5, 0.5, 0.5]
+IMAGE_STD = [0.5, 0.5, 0.5]
+RESAMPLE = Image.BILINEAR
+
+def decode_image(image):
+    """
+    PIL image in RGB from a filename, the bytes of an image file, a (height, width, 3) uint8 RGB frame or a PIL image
+    """
+    if isinstance(image, (str, os.PathLike)):
+        image = Image.open(image)
+    elif isinstance(image, (bytes, bytearray, memoryview)):
+        image = Image.open(io.BytesIO(image))
+    elif isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    return image.convert("RGB")
+
+class ImagePreprocessor():
+    """
+    Resize, convert and normalise the images straight into one preallocated (batch_size, 3, 224, 224) float32 tensor
+
+    Each image is decoded and resized once with PIL, and the uint8 to float conversion, the rescale and the normalisation are
+    folded into one multiply and one add per channel, written straight into the image's slot of the batch, so there is no
+    intermediate float image. The batch tensor is pinned when CUDA is there, so it can be copied to the GPU asynchronously
+    The batch is reused: what preprocess gives back is only valid until the next call
+    """
+    def __init__(self, batch_size, image_size = IMAGE_SIZE, image_mean = IMAGE_MEAN, image_std = IMAGE_STD, pin_memory = None):
+        import torch
+        if pin_memory is None:
+            pin_memory = torch.cuda.is_available()
+        self.image_size = image_size
+        self.batch = torch.empty((batch_size, 3, image_size, image_size), dtype=torch.float32, pin_memory=pin_memory)
+        self.batch_array = self.batch.numpy() ##same memory, filled with numpy
+        ##(value / 255 - mean) / std = value * scale + offset, for each channel
+        self.scale = (1 / (255 * np.array(image_std))).astype(np.float32)[:, None, None]
+        self.offset = (-np.array(image_mean) / np.array(image_std)).astype(np.float32)[:, None, None]
+
+    def resize(self, image):
+        """
+        (image_size, image_size, 3) uint8 array of the image (anything decode_image takes)
+        """
+        image = decode_image(image)
+        if image.size != (self.image_size, self.image_size):
+            image = image.resize((self.image_size, self.image_size), RESAMPLE)
+        return np.asarray(image)
+
+    def fill(self, index, image):
+        self.fill_pixels(index, self.resize(image))
+
+    def fill_pixels(self, index, pixels):
+        """
+        Normalise an image already resized (see resize) into slot index of the batch
+        """
+        pixels = pixels.transpose(2, 0, 1) ##channels first, like the model
+        np.multiply(pixels, self.scale, out=self.batch_array[index])
+        self.batch_array[index] += self.offset
+
+    def preprocess(self, images, executor = None):
+        """
+        Fill the batch with images (at most batch_size of them), on the threads of executor when it is given
+        Output: (len(images), 3, image_size, image_size) view of the batch tensor
+        """
+        if len(images) > len(self.batch):
+            raise ValueError(f"{len(images)} images don't fit in a batch of {len(self.batch)}")
+        if executor is None:
+            for index, image in enumerate(images):
+                self.fill(index, image)
+        else:
+            list(executor.map(self.fill, range(len(images)), images))
+        return self.batch[:len(images)]
@@ -0,0 +1,293 @@
+"""
+Streaming inference over the frames of a video, a directory of frames or any iterator of frames
+
+The frames go through a pipeline of bounded queues, so a slow stage holds back the ones before it instead of piling up frames in memory
+    decode thread -> frame queue -> batching thread (preprocessed by a pool of threads) -> batch queue -> model (the caller's thread)
+Each batch is preprocessed into one of a few preallocated batch tensors, the next batch is prepared while the model runs on the current one
+The decode thread reads the frames of a video, image files (a directory of frames) are decoded by the preprocessing threads
+
+Example
+python streaming.py video.mp4 --batch-size 32 --workers 4
+python streaming.py frames_directory --fps 25
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from preprocessing import ImagePreprocessor
+from inference_cache import FrameSkipper, perceptual_hash, FRAME_DIFFERENCE, MAX_SKIP
+from vision_transformer import ViTForUAVHuman, BATCH_SIZE
+
+QUEUE_SIZE = 64 ##frames decoded ahead of the preprocessing
+BUFFERS = 2 ##batch tensors, one being preprocessed while the model runs on the other
+MAX_DELAY = 0.05 ##seconds the first frame of a batch waits for the others, so a slow stream isn't held back
+FPS = 30 ##frame rate used for the timestamps when the source doesn't give them
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+END = None ##end of the stream in the queues
+
+def video_frames(video_filename):
+    """
+    Generator of (timestamp in seconds, RGB frame) of a video file, decoded with OpenCV
+    """
+    try:
+        import cv2
+    except ImportError:
+        raise ImportError("Reading a video file needs OpenCV, pip install opencv-python (or give a directory of frames)")
+    video = cv2.VideoCapture(video_filename)
+    if not video.isOpened():
+        raise ValueError(f"Can't open the video {video_filename}")
+    try:
+        while True:
+            read, frame = video.read()
+            if not read:
+                break
+            yield video.get(cv2.CAP_PROP_POS_MSEC) / 1000, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    finally:
+        video.release()
+
+def frame_source(frames, fps = FPS):
+    """
+    Generator of (timestamp in seconds, frame) from a video file, a directory of frames (in the order of their filenames)
+    or an iterator of frames, each one anything decode_image takes, or a (timestamp, frame) pair
+    Without a timestamp, frame i is at i / fps
+    """
+    if isinstance(frames, (str, os.PathLike)):
+        if not os.path.isdir(frames):
+            yield from video_frames(frames)
+            return
+        frames = [os.path.join(frames, frame_file) for frame_file in sorted(os.listdir(frames)) if frame_file.lower().endswith(IMAGE_EXTENSIONS)]
+
+    for index, frame in enumerate(frames):
+        if isinstance(frame, tuple):
+            yield frame
+        else:
+            yield index / fps, frame
+
+class StreamMetrics():
+    """
+    Throughput of the pipeline and depth of its queues, to size the workers and the queues
+    """
+    def __init__(self, cache = None, frame_skipper = None):
+        self.start = time.perf_counter()
+        self.cache = cache
+        self.frame_skipper = frame_skipper
+        self.frames_decoded = 0
+        self.frames_predicted = 0
+        self.frames_scored = 0 ##frames that went through the model, the others came from the cache or reused the last prediction
+        self.batches = 0
+        self.stage_seconds = {"decode" : 0.0, "preprocess" : 0.0, "model" : 0.0}
+        self.frame_queue_depths = []
+        self.batch_queue_depths = []
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start
+        def depths(samples):
+            return {"mean" : float(np.mean(samples)) if samples else 0.0, "max" : int(max(samples, default=0))}
+        summary = {"frames_decoded" : self.frames_decoded, "frames_predicted" : self.frames_predicted, "frames_scored" : self.frames_scored,
+                   "batches" : self.batches, "elapsed_seconds" : elapsed, "frames_per_second" : self.frames_predicted / elapsed if elapsed > 0 else 0.0,
+                   "average_batch_size" : self.frames_scored / self.batches if self.batches else 0.0,
+                   "stage_seconds" : dict(self.stage_seconds),
+                   "frame_queue_depth" : depths(self.frame_queue_depths), "batch_queue_depth" : depths(self.batch_queue_depths)}
+        if self.cache is not None:
+            summary["cache"] = self.cache.stats()
+        if self.frame_skipper is not None:
+            summary["frame_skip"] = self.frame_skipper.stats()
+        return summary
+
+class StreamPipeline():
+    """
+    Iterate over it to get (frame index, timestamp, confidences, results) for every frame, in the order of the frames
+    metrics is updated as it goes, and the pipeline stops when the iteration stops (or close is called)
+
+    The predictions are looked up in the cache of vit first (see ViTForUAVHuman.enable_cache), and with frame_skipper
+    (a FrameSkipper) a frame that hardly changed since the last scored frame reuses its prediction
+    """
+    def __init__(self, vit, frames, batch_size = BATCH_SIZE, workers = None, queue_size = QUEUE_SIZE, buffers = BUFFERS,
+                 max_delay = MAX_DELAY, fps = FPS, frame_skipper = None):
+        self.vit = vit
+        self.frames = frames
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_delay = max_delay
+        self.fps = fps
+        self.frame_queue = queue.Queue(maxsize=queue_size)
+        self.batch_queue = queue.Queue(maxsize=buffers)
+        self.free_buffers = queue.Queue()
+        for _ in range(buffers):
+            self.free_buffers.put(ImagePreprocessor(batch_size))
+        self.cache = vit.cache
+        self.frame_skipper = frame_skipper
+        self.stopping = threading.Event()
+        self.metrics = StreamMetrics(self.cache, frame_skipper)
+
+    def put(self, target_queue, item):
+        """
+        Blocking put that gives up when the pipeline is stopping
+        Output: False when it gave up
+        """
+        while not self.stopping.is_set():
+            try:
+                target_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def decode_loop(self):
+        try:
+            source = frame_source(self.frames, self.fps)
+            index = 0
+            while True:
+                start = time.perf_counter()
+                item = next(source, END)
+                self.metrics.stage_seconds["decode"] += time.perf_counter() - start
+                if item is END:
+                    break
+                self.metrics.frames_decoded += 1
+                if not self.put(self.frame_queue, (index, *item)):
+                    return
+                index += 1
+            self.put(self.frame_queue, END)
+        except Exception as error:
+            self.put(self.frame_queue, error)
+
+    def batch_loop(self):
+        """
+        Group the decoded frames into batches and preprocess them into a free batch tensor
+        A batch is sent when it is full, at the end of the stream, or max_delay after its first frame
+        """
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                ended = False
+                while not ended and not self.stopping.is_set():
+                    item = self.frame_queue.get()
+                    if item is END or isinstance(item, Exception):
+                        self.put(self.batch_queue, item)
+                        return
+                    batch = [item]
+                    deadline = time.perf_counter() + self.max_delay
+                    while len(batch) < self.batch_size:
+                        try:
+                            item = self.frame_queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+                        except queue.Empty:
+                            break
+                        if item is END or isinstance(item, Exception):
+                            ended = True
+                            break
+                        batch.append(item)
+                    self.metrics.frame_queue_depths.append(self.frame_queue.qsize())
+
+                    preprocessor = self.free_buffers.get()
+                    if preprocessor is END: ##closed
+                        return
+                    start = time.perf_counter()
+                    pixel_values, plan = self.preprocess(batch, preprocessor, executor)
+                    self.metrics.stage_seconds["preprocess"] += time.perf_counter() - start
+                    if not self.put(self.batch_queue, (batch, preprocessor, pixel_values, plan)):
+                        return
+                if ended:
+                    self.put(self.batch_queue, item)
+        except Exception as error:
+            self.put(self.batch_queue, error)
+
+    def preprocess(self, batch, preprocessor, executor):
+        """
+        Resize the frames of a batch, and fill the batch tensor with the ones the model has to score
+        Output: batch tensor (None when no frame needs the model), plan of where the prediction of each frame comes from:
+        ("model", row of the batch tensor, perceptual hash), ("cache", record) or ("last",) to reuse the prediction of the frame before
+        """
+        pixels = list(executor.map(preprocessor.resize, [frame for _, _, frame in batch]))
+        plan = []
+        to_score = []
+        for frame_pixels in pixels:
+            if self.frame_skipper is not None and self.frame_skipper.skip(frame_pixels):
+                plan.append(("last",))
+                continue
+            key = perceptual_hash(frame_pixels) if self.cache is not None else None
+            record = self.cache.get(key) if key is not None else None
+            if record is not None:
+                plan.append(("cache", record))
+            else:
+                plan.append(("model", len(to_score), key))
+                to_score.append(frame_pixels)
+
+        if len(to_score) == 0:
+            return None, plan
+        list(executor.map(preprocessor.fill_pixels, range(len(to_score)), to_score))
+        return preprocessor.batch[:len(to_score)], plan
+
+    def __iter__(self):
+        threads = [threading.Thread(target=self.decode_loop, daemon=True), threading.Thread(target=self.batch_loop, daemon=True)]
+        for thread in threads:
+            thread.start()
+        record = None ##prediction of the frame before
+        try:
+            while True:
+                item = self.batch_queue.get()
+                if item is END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                batch, preprocessor, pixel_values, plan = item
+                self.metrics.batch_queue_depths.append(self.batch_queue.qsize())
+
+                records = None
+                if pixel_values is not None:
+                    start = time.perf_counter()
+                    records = self.vit.predict_pixels(pixel_values)
+                    self.metrics.stage_seconds["model"] += time.perf_counter() - start
+                    self.metrics.batches += 1
+                    self.metrics.frames_scored += len(records)
+                self.free_buffers.put(preprocessor) ##the batch tensor can be filled again
+                self.metrics.frames_predicted += len(batch)
+
+                for (index, timestamp, _), step in zip(batch, plan):
+                    if step[0] == "model":
+                        record = records[step[1]].copy()
+                        if self.cache is not None:
+                            self.cache.put(step[2], record)
+                    elif step[0] == "cache":
+                        record = step[1]
+                    ##"last" keeps the record of the frame before
+                    yield index, timestamp, record.confidence.tolist(), self.vit.decoder.results(record).tolist()
+        finally:
+            self.close()
+            for thread in threads:
+                thread.join()
+
+    def close(self):
+        self.stopping.set()
+        ##unblock the batching thread if it is waiting for a frame or for a free batch tensor
+        for target_queue in (self.frame_queue, self.free_buffers):
+            try:
+                target_queue.put_nowait(END)
+            except queue.Full:
+                pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Predict the attributes of the person in every frame of a video or a directory of frames")
+    parser.add_argument("frames", help = "video file or directory of frames")
+    parser.add_argument("--batch-size", type = int, default = BATCH_SIZE)
+    parser.add_argument("--workers", type = int, default = None, help = "number of threads preprocessing the frames")
+    parser.add_argument("--queue-size", type = int, default = QUEUE_SIZE, help = "frames decoded ahead of the preprocessing")
+    parser.add_argument("--fps", type = float, default = FPS, help = "frame rate of a directory of frames")
+    parser.add_argument("--weights-file", default = None, help = "local .safetensors weights, memory mapped")
+    parser.add_argument("--cache", action = "store_true", help = "reuse the prediction of a frame that looks the same as one already scored")
+    parser.add_argument("--skip-threshold", type = float, default = None,
+                        help = f"reuse the last prediction while the frame differs from the last scored one by less than this (grey levels, {FRAME_DIFFERENCE} is a good start)")
+    parser.add_argument("--max-skip", type = int, default = MAX_SKIP, help = "most frames in a row reusing the same prediction")
+    args = parser.parse_args()
+
+    vit = ViTForUAVHuman(weights_file = args.weights_file)
+    if args.cache:
+        vit.enable_cache()
+    frame_skipper = FrameSkipper(args.skip_threshold, args.max_skip) if args.skip_threshold is not None else None
+    pipeline = vit.model_inference_stream(args.frames, args.batch_size, args.workers, args.queue_size, fps = args.fps, frame_skipper = frame_skipper)
+    for index, timestamp, confidences, result in pipeline:
+        print(f"{index} {timestamp:.3f}s: {', '.join(result)}")
+    print(json.dumps(pipeline.metrics.summary(), indent=4))
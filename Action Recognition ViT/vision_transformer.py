@@ -1,64 +1,222 @@
-from PIL import Image
-import math
-from transformers import AutoModelForImageClassification, AutoFeatureExtractor
-import torch
+import json
+import mmap
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from postprocessing import AttributeDecoder, LABEL_NAMES
+from preprocessing import ImagePreprocessor
+from inference_cache import InferenceCache, perceptual_hash, CACHE_SIZE, CACHE_TTL
+##torch and transformers take seconds to import, they are imported when the model is first used
+
+BATCH_SIZE = 32 ##number of images going through the model at once
+MODEL_ID = "Heartsream/vit-KAIYI"
+TOKEN = 'REQUEST FOR IT' ##request the token if you want to use it
+BACKENDS = ["eager", "int8", "torchscript"] ##fp32 model, model with its Linear layers quantised to int8, model exported by export_model.py
+
+##models already loaded in this process, shared by every ViTForUAVHuman
+MODEL_CACHE = {}
+MODEL_CACHE_LOCK = threading.RLock() ##the int8 model is loaded from the eager model, inside the lock
+
+def cached(key, load):
+    """
+    The object cached under key, loaded with load() the first time (only once even when several threads ask for it together)
+    """
+    with MODEL_CACHE_LOCK:
+        if key not in MODEL_CACHE:
+            MODEL_CACHE[key] = load()
+        return MODEL_CACHE[key]
+
+def load_safetensors_mmap(weights_file):
+    """
+    State dict of a .safetensors file whose tensors point straight into a memory map of the file
+    The map is private (copy on write), so every process loading the same file shares its pages in the OS page cache
+    instead of holding its own copy of the weights
+    """
+    import torch
+    dtypes = {"F64" : torch.float64, "F32" : torch.float32, "F16" : torch.float16, "BF16" : torch.bfloat16,
+              "I64" : torch.int64, "I32" : torch.int32, "I16" : torch.int16, "I8" : torch.int8, "U8" : torch.uint8, "BOOL" : torch.bool}
+    with open(weights_file, "rb") as weights:
+        weights_map = mmap.mmap(weights.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    ##the file starts with the length of its json header, then the header, then the data of every tensor
+    header_size = int.from_bytes(weights_map[:8], "little")
+    header = json.loads(weights_map[8:8 + header_size])
+    header.pop("__metadata__", None)
+    state_dict = {}
+    for name, tensor in header.items():
+        start, end = tensor["data_offsets"]
+        dtype = dtypes[tensor["dtype"]]
+        count = (end - start) // torch.empty(0, dtype=dtype).element_size()
+        state_dict[name] = torch.frombuffer(weights_map, dtype=dtype, count=count, offset=8 + header_size + start).view(tensor["shape"])
+    return state_dict
+
+def load_model(model_id = MODEL_ID, token = TOKEN, weights_file = None, backend = "eager"):
+    """
+    The model, loaded once per process, with the int8 backend its Linear layers are quantised (see quantize_linear_layers)
+    With weights_file (a local .safetensors file), only the config is read from model_id (a hub id or a local directory),
+    and the weights are the memory mapped tensors of the file (see load_safetensors_mmap). They go through from_pretrained,
+    which renames the keys of older checkpoints to the names of the installed transformers, and the parameters are kept
+    as the mapped tensors, not copied
+    """
+    if backend == "int8":
+        return cached(("model", model_id, weights_file, backend), lambda: quantize_linear_layers(load_model(model_id, token, weights_file)))
+
+    def load():
+        from transformers import AutoConfig, AutoModelForImageClassification, MODEL_FOR_IMAGE_CLASSIFICATION_MAPPING
+        if weights_file is None:
+            return AutoModelForImageClassification.from_pretrained(model_id, token=token).eval()
+        config = AutoConfig.from_pretrained(model_id, token=token)
+        ##a state dict can only be given to the model class itself, with no model id
+        model_class = MODEL_FOR_IMAGE_CLASSIFICATION_MAPPING[type(config)]
+        return model_class.from_pretrained(None, config=config, state_dict=load_safetensors_mmap(weights_file)).eval()
+    return cached(("model", model_id, weights_file), load)
+
+def quantize_linear_layers(model):
+    """
+    Copy of the model with the weights of its Linear layers (most of the compute of a ViT) quantised to int8, their activations
+    are quantised on the fly for each batch. Runs on the CPU only
+    """
+    import torch
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8).eval()
+
+def load_torchscript(torchscript_file):
+    """
+    TorchScript model saved by export_model.py, taking the (N, 3, 224, 224) pixel values and giving back the logits
+    """
+    def load():
+        import torch
+        return torch.jit.load(torchscript_file, map_location="cpu").eval()
+    return cached(("torchscript", torchscript_file), load)
 
 class ViTForUAVHuman():
-    def __init__(self) -> None:
-        self.model = AutoModelForImageClassification.from_pretrained("Heartsream/vit-KAIYI", use_auth_token='REQUEST FOR IT') ##request the token if you want to use it 
-        self.feature_extractor = AutoFeatureExtractor.from_pretrained("google/vit-base-patch16-224-in21k") ##same feature extractor that was used for feature extraction during training
+    def __init__(self, model_id = MODEL_ID, token = TOKEN, weights_file = None, backend = "eager", torchscript_file = None) -> None:
+        """
+        Nothing is loaded here, the model is loaded (or taken from MODEL_CACHE) when first used
+        weights_file is a local .safetensors file of the weights, loaded through a memory map (see load_safetensors_mmap)
+        backend is one of BACKENDS, the torchscript backend runs torchscript_file (made by export_model.py)
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, should be one of {BACKENDS}")
+        if backend == "torchscript" and torchscript_file is None:
+            raise ValueError("The torchscript backend needs a torchscript_file")
+        self.backend = backend
+        self.torchscript_file = torchscript_file
+        self.model_id = model_id
+        self.token = token
+        self.weights_file = weights_file
+        self._model = None
+        self._preprocessor = None
+        self.cache = None ##InferenceCache of the predictions, see enable_cache
+        self.decoder = AttributeDecoder() ##label groups and names, prepared once
+
+    @property
+    def model(self):
+        if self._model is None:
+            if self.backend == "torchscript":
+                self._model = load_torchscript(self.torchscript_file)
+            else:
+                self._model = load_model(self.model_id, self.token, self.weights_file, self.backend)
+        return self._model
+
+    def preprocessor(self, batch_size):
+        """
+        ImagePreprocessor with room for batch_size images, the preprocessing of google/vit-base-patch16-224-in21k the model was trained with
+        Its batch tensor is reused by every call, so one ViTForUAVHuman shouldn't score images from several threads at once
+        """
+        if self._preprocessor is None or len(self._preprocessor.batch) < batch_size:
+            self._preprocessor = ImagePreprocessor(batch_size)
+        return self._preprocessor
+
+    def enable_cache(self, max_size = CACHE_SIZE, ttl = CACHE_TTL):
+        """
+        Keep the predictions in an InferenceCache keyed by the perceptual hash of each image, so an image that looks the same
+        as one scored less than ttl seconds ago isn't sent to the model again. cache.stats() gives the hit rate
+        """
+        self.cache = InferenceCache(max_size, ttl)
+        return self.cache
 
     def __repr__(self):
         return "Vision Transformer"
     
     def convert_label_to_str(self,label):
-        label_dict = {0 : "No Gender", 1 : "Male", 2 : "Female", 
-                    3 : "No Backpack", 4 : "Red Backpack", 5 : "Black Backpack", 6 : "Green Backpack", 7 : "Yellow Backpack", 8 : "No Backpack", 
-                    9 : "No Hat", 10 : "Red Hat", 11 : "Black Hat", 12 : "Yellow Hat", 13 : "White Hat", 14 : "No Hat", 
-                    15 : "Upper Clothing None", 16 : "Upper Clothing Red", 17 : "Upper Clothing Black", 18 : "Upper Clothing Blue", 19 : "Upper Clothing Green", 20 : "Upper Clothing Multicolor", 21 : "Upper Clothing Grey", 22 : "Upper Clothing White", 23 : "Upper Clothing Yellow", 24 : "Upper Clothing DarkBrown", 25 : "Upper Clothing Purple", 26 : "Upper Clothing Pink", 
-                    27 : "Upper Style None", 28 : "Upper Style Long", 29 : "Upper Style Short", 30 : "Upper Style Skirt", 
-                    31 : "Lower Clothing None", 32 : "Lower Clothing Red", 33 : "Lower Clothing Black", 34 : "Lower Clothing Blue", 35 : "Lower Clothing Green", 36 : "Lower Clothing Multicolor", 37 : "Lower Clothing Grey", 38 : "Lower Clothing White", 39 : "Lower Clothing Yellow", 40 : "Lower Clothing DarkBrown", 41 : "Lower Clothing Purple", 42 : "Lower Clothing Pink", 
-                    43 : "Lower Style None", 44 : "Lower Style Long", 45 : "Lower Style Short", 46 : "Lower Style Skirt"}
-    
-        return label_dict.get(label)
-
-    def predict(self, arr, start_index, end_index):
-        max_value = -math.inf
-        max_index = None
-        total = 0
-        for i in range(start_index, end_index):
-            total += arr[i]
-            if arr[i] > max_value:
-                max_value = arr[i]
-                max_index = i
-            
-        return max_index, float(arr[max_index] / total)
+        return LABEL_NAMES[label] if 0 <= label < len(LABEL_NAMES) else None
 
-    def model_inference(self,image_filename : str):
-        image = Image.open(image_filename).convert("RGB")
-        
-        # prepare image for the model
-        encoding = self.feature_extractor(image, return_tensors="pt")
-        
+    def predict_pixels(self, pixel_values):
+        """
+        Record array of the predictions (see AttributeDecoder.decode) for a preprocessed (N, 3, 224, 224) batch tensor
+        """
+        import torch
         # forward pass
         with torch.no_grad():
-            outputs = self.model(**encoding)
-            logits = outputs.logits
-        
-        ##apply softmax to get the probability of each label
-        probs = torch.nn.functional.softmax(logits, dim = 1)
-        offset_array = [3,6,6,12,4,12,4] ##our dataset has 7 labels
-        label_category = ["Gender", "Backpack", "Hat", "Upper Clothing Colour", "Upper Clothing Style", "Lower Clothing Colour", "Lower Clothing Style"]
-        y_confidence = [] ##to store the conficence level for each prediction
-        result = [] ##to store the predicted attributes
-
-        offset = 0
-        for i in range(len(offset_array)):
-            selected_label, confidence = self.predict(probs[0], offset, offset_array[i]+offset)
-
-            ##add the formated string of "category" : "result"
-            result.append(" : ".join([label_category[i],self.convert_label_to_str(selected_label)]))
-            y_confidence.append(confidence)
-            offset += offset_array[i]
-        
-        return y_confidence, result
\ No newline at end of file
+            if self.backend == "torchscript":
+                logits = self.model(pixel_values)
+            else:
+                logits = self.model(pixel_values=pixel_values.to(self.model.device, non_blocking=True)).logits
+
+        ##softmax of each label group, done on the logits by the decoder
+        return self.decoder.decode(logits.cpu().numpy())
+
+    def predict_cached(self, images, preprocessor, executor):
+        """
+        Records of a batch of images, only the images missing from the cache go through the model
+        """
+        pixels = list(executor.map(preprocessor.resize, images))
+        keys = list(executor.map(perceptual_hash, pixels))
+        records = np.empty(len(images), dtype = self.decoder.dtype).view(np.recarray)
+        missing = []
+        for index, key in enumerate(keys):
+            record = self.cache.get(key)
+            if record is None:
+                missing.append(index)
+            else:
+                records[index] = record
+
+        if len(missing) > 0:
+            list(executor.map(preprocessor.fill_pixels, range(len(missing)), [pixels[index] for index in missing]))
+            records[missing] = self.predict_pixels(preprocessor.batch[:len(missing)])
+            for index in missing:
+                self.cache.put(keys[index], records[index].copy())
+        return records
+
+    def model_inference(self,image_filename : str):
+        image_filename, y_confidence, result = self.model_inference_batch([image_filename])[0]
+        return y_confidence, result
+
+    def model_inference_batch(self, images, batch_size = BATCH_SIZE, workers = None):
+        """
+        model_inference for a list of images, gives back a list of (image, confidences, results)
+        Each image is a filename, the bytes of an image file or a (height, width, 3) uint8 RGB frame
+        """
+        records = self.model_inference_records(images, batch_size, workers)
+        return list(zip(images, records.confidence.tolist(), self.decoder.results(records).tolist()))
+
+    def model_inference_records(self, images, batch_size = BATCH_SIZE, workers = None):
+        """
+        Record array with the selected label and the confidence of each label group of each image (see AttributeDecoder.decode)
+        The images are decoded and preprocessed by a pool of threads straight into one batch tensor (see ImagePreprocessor),
+        which goes through the model in a single forward pass
+        """
+        preprocessor = self.preprocessor(min(batch_size, max(len(images), 1)))
+        batch_records = []
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            for start in range(0, len(images), batch_size):
+                if self.cache is not None:
+                    batch_records.append(self.predict_cached(images[start:start + batch_size], preprocessor, executor))
+                    continue
+
+                # prepare the images for the model, in one (N, 3, 224, 224) tensor
+                pixel_values = preprocessor.preprocess(images[start:start + batch_size], executor)
+
+                batch_records.append(self.predict_pixels(pixel_values))
+        if len(batch_records) == 0:
+            return np.empty(0, dtype = self.decoder.dtype).view(np.recarray)
+        return np.concatenate(batch_records).view(np.recarray)
+
+    def model_inference_stream(self, frames, batch_size = BATCH_SIZE, workers = None, queue_size = None, **options):
+        """
+        Streaming inference over a video file, a directory of frames or an iterator of frames (see streaming.StreamPipeline)
+        Iterate over what it gives back to get (frame index, timestamp, confidences, results) for every frame, its metrics
+        give the throughput and the depth of the queues
+        """
+        from streaming import StreamPipeline, QUEUE_SIZE
+        return StreamPipeline(self, frames, batch_size, workers, queue_size or QUEUE_SIZE, **options)
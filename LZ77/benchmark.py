@@ -0,0 +1,109 @@
+'''
+Benchmark of the match finders used by lz77
+
+Compares the z algorithm path with the hash chain and binary tree match finders on secret.asc and on
+synthetic asc files, and checks that every match finder gives the same triples
+
+With --workers, the block container is also encoded and decoded with each number of worker processes (with the hash chain
+match finder unless --workers-match-finder says otherwise)
+
+Example
+python benchmark.py --window 4096 --lookahead 64 --sizes 10 100
+python benchmark.py --sizes 10 --match-finders hash_chain --workers 1 2 4 8
+'''
+import argparse
+import os
+import random
+import tempfile
+import time
+from myzip import compress_txt_file_parallel, lz77, read_input
+from myunzip import decode_bin
+
+def generate_synthetic_asc(filename, size_in_mb, sample_text, seed = 7):
+    '''
+    Write a synthetic asc file made of lines of the sample text, with some characters changed so that it is not only repetition
+    '''
+    random.seed(seed)
+    lines = [line for line in sample_text.split(b"\n") if line]
+    alphabet = sorted(set(sample_text) - {ord("\n")})
+    target_size = int(size_in_mb * 1024 * 1024)
+    written = 0
+
+    with open(filename, "wb") as output:
+        while written < target_size:
+            line = bytearray(random.choice(lines))
+            for _ in range(random.randint(0, 4)):
+                line[random.randrange(len(line))] = random.choice(alphabet)
+            line += b"\n"
+            output.write(line)
+            written += len(line)
+
+
+def time_match_finder(text, window_limit_size, lookahead_limit_size, match_finder):
+    start = time.perf_counter()
+    output = lz77(text, window_limit_size, lookahead_limit_size, match_finder)
+    return time.perf_counter() - start, output
+
+
+def benchmark_text(name, text, window_limit_size, lookahead_limit_size, match_finders, z_limit):
+    print(f"\n{name}: {len(text)} characters, window {window_limit_size}, lookahead {lookahead_limit_size}")
+    reference = None
+    for match_finder in match_finders:
+        if match_finder == "z" and len(text) > z_limit:
+            print(f"  {match_finder:<12} skipped (more than {z_limit} characters)")
+            continue
+
+        seconds, output = time_match_finder(text, window_limit_size, lookahead_limit_size, match_finder)
+        if reference is None:
+            reference = output
+        same = "same triples" if output == reference else "DIFFERENT triples"
+        print(f"  {match_finder:<12} {seconds:10.3f} s {len(text) / seconds / 1e6:8.3f} MB/s {len(output):>10} triples  {same}")
+
+
+def benchmark_workers(filename, text, window_limit_size, lookahead_limit_size, match_finder, workers_list, block_size):
+    '''
+    Encode and decode filename as a block container with each number of workers
+    The decoded file is written back over filename, and compared with a copy of text taken before
+    (text may be a memory map of filename, which the decoding rewrites)
+    '''
+    original = bytes(text)
+    print(f"\n{filename}: block container, {match_finder}, blocks of {block_size} characters")
+    for workers in workers_list:
+        start = time.perf_counter()
+        compress_txt_file_parallel(filename, window_limit_size, lookahead_limit_size, match_finder, workers, block_size)
+        compress_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        decode_bin(filename + ".bin", workers)
+        decode_seconds = time.perf_counter() - start
+
+        with open(filename, "rb") as decoded_file:
+            same = "round trip ok" if decoded_file.read() == original else "ROUND TRIP FAILED"
+        print(f"  {workers:>2} workers  encode {compress_seconds:8.3f} s {len(text) / compress_seconds / 1e6:8.3f} MB/s"
+              f"  decode {decode_seconds:8.3f} s {len(text) / decode_seconds / 1e6:8.3f} MB/s  {os.path.getsize(filename + '.bin'):>10} bytes  {same}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark the lz77 match finders")
+    parser.add_argument("--input", default = os.path.join(os.path.dirname(os.path.abspath(__file__)), "secret.asc"))
+    parser.add_argument("--window", type = int, default = 4096)
+    parser.add_argument("--lookahead", type = int, default = 64)
+    parser.add_argument("--sizes", type = float, nargs = "*", default = [10, 100], help = "sizes of the synthetic files in MB")
+    parser.add_argument("--match-finders", nargs = "+", default = ["z", "hash_chain", "binary_tree"])
+    parser.add_argument("--z-limit", type = int, default = 1024 * 1024, help = "skip the z algorithm on texts longer than this")
+    parser.add_argument("--workers", type = int, nargs = "*", default = [], help = "numbers of worker processes for the block container")
+    parser.add_argument("--block-size", type = int, default = 1 << 20, help = "number of characters per block of the block container")
+    parser.add_argument("--workers-match-finder", default = "hash_chain", choices = ["hash_chain", "binary_tree", "z"], help = "match finder of the block container")
+    args = parser.parse_args()
+
+    sample_text = read_input(args.input)
+    benchmark_text(args.input, sample_text, args.window, args.lookahead, args.match_finders, args.z_limit)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            filename = os.path.join(directory, f"synthetic_{size}MB.asc")
+            generate_synthetic_asc(filename, size, sample_text[:])
+            text = read_input(filename)
+            benchmark_text(filename, text, args.window, args.lookahead, args.match_finders, args.z_limit)
+            if args.workers:
+                benchmark_workers(filename, text, args.window, args.lookahead, args.workers_match_finder, args.workers, args.block_size)
@@ -0,0 +1,125 @@
+'''
+Bit level writing for the lz77 encoder
+
+The bits are written from the most significant bit of each byte, and the last byte is padded with 0s
+to the right, which is the layout of the .bin files
+'''
+
+class BitWriter():
+    '''
+    Collect codes of any bit length and turn them into bytes
+
+    The accumulator never holds more than 7 bits between writes, every whole byte is moved into a
+    preallocated bytearray straight away, so there is no growing integer and no bit length to recompute
+    '''
+    def __init__(self, initial_capacity = 4096):
+        self.buffer = bytearray(initial_capacity)
+        self.byte_position = 0 #number of whole bytes in the buffer
+        self.accumulator = 0 #bits that are not a whole byte yet
+        self.accumulator_length = 0 #number of bits in the accumulator
+        self.bit_count = 0 #total number of bits written
+
+    def write(self, value, bit_length):
+        '''
+        Write the bit_length lowest bits of value, most significant bit first
+        Input: value, number of bits (the bits above the value are 0s)
+        '''
+        accumulator = (self.accumulator << bit_length) | value
+        accumulator_length = self.accumulator_length + bit_length
+        self.bit_count += bit_length
+
+        if accumulator_length >= 8:
+            byte_count = accumulator_length >> 3
+            if self.byte_position + byte_count > len(self.buffer):
+                self.grow(byte_count)
+
+            accumulator_length -= byte_count << 3
+            self.buffer[self.byte_position : self.byte_position + byte_count] = (accumulator >> accumulator_length).to_bytes(byte_count, "big")
+            self.byte_position += byte_count
+            accumulator &= (1 << accumulator_length) - 1
+
+        self.accumulator = accumulator
+        self.accumulator_length = accumulator_length
+
+    def grow(self, byte_count):
+        '''
+        Double the buffer (at least enough for byte_count more bytes)
+        '''
+        extra = max(len(self.buffer), byte_count)
+        self.buffer.extend(bytes(extra))
+
+    def flush_bytes(self, output_file):
+        '''
+        Write the whole bytes into output_file and empty the buffer, the bits that are not a whole byte yet are kept
+        '''
+        output_file.write(self.buffer[:self.byte_position])
+        self.byte_position = 0
+
+    def getvalue(self):
+        '''
+        All the bytes written so far, the bits that are not a whole byte yet are padded with 0s to the right
+        '''
+        output = self.buffer[:self.byte_position]
+        if self.accumulator_length > 0:
+            output.append(self.accumulator << (8 - self.accumulator_length))
+        return output
+
+
+class BitReader():
+    '''
+    Read codes of any bit length from bytes, most significant bit first
+
+    The bytes are read through a memoryview so nothing is copied, and up to 8 bytes at a time are
+    moved into the accumulator. Peeking past the end of the data gives 0s (this is needed by the
+    lookup tables near the end of the file), but reading past the end raises an exception
+    '''
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.byte_position = 0 #next byte to move into the accumulator
+        self.accumulator = 0
+        self.accumulator_length = 0 #number of bits in the accumulator
+        self.bit_position = 0 #number of bits read so far
+        self.bit_count = len(self.data) * 8
+
+    def fill(self, bit_length):
+        '''
+        Make sure the accumulator has at least bit_length bits
+        '''
+        while self.accumulator_length < bit_length:
+            chunk = self.data[self.byte_position : self.byte_position + 8]
+            if len(chunk) > 0:
+                self.accumulator = (self.accumulator << (len(chunk) * 8)) | int.from_bytes(chunk, "big")
+                self.accumulator_length += len(chunk) * 8
+                self.byte_position += len(chunk)
+            else:
+                #past the end of the data
+                self.accumulator <<= bit_length - self.accumulator_length
+                self.accumulator_length = bit_length
+
+    def peek(self, bit_length):
+        '''
+        The next bit_length bits as a number, without moving forward
+        '''
+        if self.accumulator_length < bit_length:
+            self.fill(bit_length)
+        return (self.accumulator >> (self.accumulator_length - bit_length)) & ((1 << bit_length) - 1)
+
+    def skip(self, bit_length):
+        '''
+        Move forward by bit_length bits
+        '''
+        if self.accumulator_length < bit_length:
+            self.fill(bit_length)
+        self.bit_position += bit_length
+        if self.bit_position > self.bit_count:
+            raise Exception("No more bytes to read")
+        self.accumulator_length -= bit_length
+        self.accumulator &= (1 << self.accumulator_length) - 1
+
+    def read(self, bit_length):
+        '''
+        Read the next bit_length bits as a number
+        '''
+        value = self.peek(bit_length)
+        self.skip(bit_length)
+        return value
@@ -0,0 +1,132 @@
+'''
+Block container for the lz77 encoder
+
+The original .bin file is a single bit stream, which starts with the elias encoding of the length of the filename.
+A block container splits the text into independent blocks, each block is a complete bit stream of its own
+(with its own huffman table and lz77 window, and an empty filename), so the blocks can be encoded and decoded separately.
+
+Layout (all numbers are big endian)
+    magic              4 bytes  b"\xffLZB", the first bit of an original .bin file is never 1 as the filename can't be empty
+    version            1 byte
+    filename length    2 bytes, followed by the filename in utf-8
+    number of char     8 bytes
+    number of blocks   4 bytes
+    block index        for each block, 8 bytes for the length of the block in bytes and 8 bytes for its number of char
+    blocks             the bit stream of each block, in order
+
+A seekable container (version 3) keeps a single bit stream with one huffman table for the whole text, but the
+lz77 window starts again at every block, so a block can be decoded on its own. Its index is made of the bit offset
+of each block in the bit stream and the position of its first character in the text
+    block index        for each block, 8 bytes for its bit offset and 8 bytes for its first character
+    bit stream         the header of an original .bin file (with an empty filename), then the blocks without any padding
+
+map_in_order runs the blocks through a pool of processes, it is shared by the encoder and the decoder
+'''
+import os
+import struct
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+MAGIC = b"\xffLZB"
+VERSION_BLOCKS = 2
+VERSION_SEEKABLE = 3
+
+HEADER_FORMAT = ">4sBH"
+COUNTS_FORMAT = ">QI"
+INDEX_ENTRY_FORMAT = ">QQ"
+
+
+def is_block_container(first_bytes):
+    return first_bytes[:len(MAGIC)] == MAGIC
+
+
+def header_size(filename, number_of_blocks):
+    return struct.calcsize(HEADER_FORMAT) + len(filename.encode()) + struct.calcsize(COUNTS_FORMAT) + number_of_blocks * struct.calcsize(INDEX_ENTRY_FORMAT)
+
+
+def pack_header(filename, number_of_char, block_index, version = VERSION_BLOCKS):
+    '''
+    block_index is a list of (length of the block in bytes, number of char in the block) for a block container,
+    or (bit offset of the block, first character of the block) for a seekable container
+    '''
+    filename_bytes = filename.encode()
+    header = bytearray(struct.pack(HEADER_FORMAT, MAGIC, version, len(filename_bytes)))
+    header += filename_bytes
+    header += struct.pack(COUNTS_FORMAT, number_of_char, len(block_index))
+    for entry in block_index:
+        header += struct.pack(INDEX_ENTRY_FORMAT, *entry)
+    return header
+
+
+def read_header(input_file):
+    '''
+    Read the header of a block container from an opened file
+    Output: version, filename, number of char, block index
+    '''
+    magic, version, filename_length = struct.unpack(HEADER_FORMAT, input_file.read(struct.calcsize(HEADER_FORMAT)))
+    if magic != MAGIC:
+        raise Exception("Not a block container")
+
+    filename = input_file.read(filename_length).decode()
+    number_of_char, number_of_blocks = struct.unpack(COUNTS_FORMAT, input_file.read(struct.calcsize(COUNTS_FORMAT)))
+
+    entry_size = struct.calcsize(INDEX_ENTRY_FORMAT)
+    index_bytes = input_file.read(number_of_blocks * entry_size)
+    block_index = [struct.unpack_from(INDEX_ENTRY_FORMAT, index_bytes, block * entry_size) for block in range(number_of_blocks)]
+
+    return version, filename, number_of_char, block_index
+
+
+def block_ranges(version, number_of_char, block_index, data_start):
+    '''
+    Where each block is, whatever the version of the container
+    Output: list of (first character, number of char, start, end) where start and end are byte offsets in the file
+    for a block container, and bit offsets in the bit stream for a seekable container
+    '''
+    ranges = []
+    if version == VERSION_BLOCKS:
+        first_char = 0
+        start = data_start
+        for compressed_length, block_number_of_char in block_index:
+            ranges.append((first_char, block_number_of_char, start, start + compressed_length))
+            first_char += block_number_of_char
+            start += compressed_length
+
+    elif version == VERSION_SEEKABLE:
+        for block in range(len(block_index)):
+            bit_offset, first_char = block_index[block]
+            if block + 1 < len(block_index):
+                next_bit_offset, next_first_char = block_index[block + 1]
+            else:
+                next_bit_offset, next_first_char = None, number_of_char
+            ranges.append((first_char, next_first_char - first_char, bit_offset, next_bit_offset))
+
+    else:
+        raise Exception("Unknown container version")
+
+    return ranges
+
+
+def map_in_order(function, arguments, workers = None):
+    '''
+    Run function over the arguments with a process pool, yield (argument, result) in the order of the arguments
+    At most 2 arguments per worker are submitted at once, so the arguments are not all read into memory
+    With a single worker, everything runs in this process
+    '''
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for argument in arguments:
+            yield argument, function(argument)
+        return
+
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        pending = deque()
+        for argument in arguments:
+            pending.append((argument, executor.submit(function, argument)))
+            if len(pending) >= 2 * workers:
+                argument, future = pending.popleft()
+                yield argument, future.result()
+
+        while pending:
+            argument, future = pending.popleft()
+            yield argument, future.result()
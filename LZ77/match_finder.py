@@ -0,0 +1,287 @@
+'''
+Match finders for the lz77 encoder
+
+Every match finder produces exactly the same [number_to_look_back, number_to_copy] pair as the
+z algorithm path in myzip.lz77, which is:
+    - the longest match inside the window, capped by the lookahead size
+    - the match always leaves at least one character behind it to be the next character
+    - on a tie, the match closest to the lookahead buffer is taken
+    - when nothing matches, the pair is [0,0]
+
+Each position of the text has to be given to the match finder exactly once and in order, either
+with find() (we want the match of this position), find_all() (we want every match length of this position,
+used by the optimal parse) or skip() (the position is copied by a previous match)
+
+max_chain limits the number of earlier positions checked by the hash chains for each position, this is how the fast
+compression levels trade ratio for speed. With a limit the matches are no longer always the longest ones
+'''
+from array import array
+
+CHUNK_SIZE = 32 #number of characters compared at once when extending a match
+
+
+def match_length(text, candidate, position, known_length, limit):
+    '''
+    Extend the common prefix of text[candidate:] and text[position:], the first known_length characters are already known to match
+    Input: text, start of the earlier occurence, start of the lookahead, length already matched, max length to check
+    Output: length of the common prefix (at most limit)
+    '''
+    length = known_length
+
+    #compare by slices first, this is done in C and is much faster than character by character
+    while length + CHUNK_SIZE <= limit and text[candidate+length : candidate+length+CHUNK_SIZE] == text[position+length : position+length+CHUNK_SIZE]:
+        length += CHUNK_SIZE
+
+    while length < limit and text[candidate+length] == text[position+length]:
+        length += 1
+    return length
+
+
+class HashChainMatchFinder():
+    '''
+    Hash chains keyed on the first 3 characters of every position in the window
+    Matches of length 1 and 2 can't be found through the chains, so the last occurence of every
+    1 and 2 character prefix is stored as well (the last occurence is always the closest one)
+
+    max_chain limits the number of candidates checked for each position, None means all the candidates
+    in the window are checked which gives the same output as the z algorithm
+
+    Complexity
+    Time: O(N * C) where N is the length of the text and C is the length of the chains walked (bounded by max_chain)
+    Space: O(W + K) where W is the window size and K the number of distinct 3 character prefixes
+    '''
+    def __init__(self, text, window_limit_size, lookahead_limit_size, max_chain = None):
+        self.text = text
+        self.window_limit_size = window_limit_size
+        self.lookahead_limit_size = lookahead_limit_size
+        self.max_chain = max_chain
+
+        self.head = {} #3 character prefix -> last position
+        self.last_2 = {} #2 character prefix -> last position
+        self.last_1 = {} #character -> last position
+        self.previous = array('q', [-1]) * (window_limit_size + 1) #previous position with the same 3 character prefix, cyclic on the window
+
+    def find(self, position):
+        '''
+        Find the match for the lookahead starting at position, then add position into the window
+        Output: [number_to_look_back, number_to_copy]
+        '''
+        text = self.text
+        limit = min(self.lookahead_limit_size, len(text) - position - 1) #must leave one character for next_char
+        lowest = position - self.window_limit_size
+
+        max_value = 0
+        number_to_look_back = 0
+
+        if limit >= 3:
+            candidate = self.head.get(text[position:position+3], -1)
+            chain_walked = 0
+            while candidate >= lowest and candidate >= 0:
+                #a candidate can only be longer if it also matches the character right after the saved match
+                if max_value < 3 or text[candidate+max_value] == text[position+max_value]:
+                    length = match_length(text, candidate, position, 3, limit) #the chain only links positions with the same 3 characters
+                else:
+                    length = 0
+
+                #candidates come from the closest one, so only a strictly longer match replaces the saved one
+                if length > max_value:
+                    max_value = length
+                    number_to_look_back = position - candidate
+                    if length == limit:
+                        break
+
+                chain_walked += 1
+                if self.max_chain is not None and chain_walked >= self.max_chain:
+                    break
+                candidate = self.previous[candidate % len(self.previous)]
+
+        #no match of 3 or more, the closest occurence of the first 2 (or 1) characters is the answer
+        if max_value == 0 and limit >= 2:
+            candidate = self.last_2.get(text[position:position+2], -1)
+            if candidate >= lowest and candidate >= 0:
+                max_value = 2
+                number_to_look_back = position - candidate
+
+        if max_value == 0 and limit >= 1:
+            candidate = self.last_1.get(text[position], -1)
+            if candidate >= lowest and candidate >= 0:
+                max_value = 1
+                number_to_look_back = position - candidate
+
+        self.skip(position)
+        return [number_to_look_back, max_value]
+
+    def find_all(self, position):
+        '''
+        Find every match length for the lookahead starting at position, then add position into the window
+        Output: list of [number_to_copy, number_to_look_back], number_to_copy is increasing and for any length k,
+        the first pair with number_to_copy >= k is the closest match of at least k characters
+        '''
+        text = self.text
+        limit = min(self.lookahead_limit_size, len(text) - position - 1) #must leave one character for next_char
+        lowest = position - self.window_limit_size
+        matches = []
+
+        #the closest occurence of the first character (or 2 characters) is the closest match of length 1 (or 2)
+        if limit >= 1:
+            candidate = self.last_1.get(text[position], -1)
+            if candidate >= lowest and candidate >= 0:
+                matches.append([1, position - candidate])
+
+        if limit >= 2 and len(matches) > 0:
+            candidate = self.last_2.get(text[position:position+2], -1)
+            if candidate >= lowest and candidate >= 0:
+                if matches[-1][1] == position - candidate:
+                    matches.pop()
+                matches.append([2, position - candidate])
+
+        if limit >= 3 and len(matches) > 0 and matches[-1][0] == 2:
+            max_value = 2
+            candidate = self.head.get(text[position:position+3], -1)
+            chain_walked = 0
+            while candidate >= lowest and candidate >= 0:
+                if max_value < 3 or text[candidate+max_value] == text[position+max_value]:
+                    length = match_length(text, candidate, position, 3, limit)
+                else:
+                    length = 0
+
+                if length > max_value:
+                    max_value = length
+                    if matches[-1][1] == position - candidate:
+                        matches.pop()
+                    matches.append([length, position - candidate])
+                    if length == limit:
+                        break
+
+                chain_walked += 1
+                if self.max_chain is not None and chain_walked >= self.max_chain:
+                    break
+                candidate = self.previous[candidate % len(self.previous)]
+
+        self.skip(position)
+        return matches
+
+    def skip(self, position):
+        '''
+        Add position into the window without looking for a match
+        '''
+        text = self.text
+        key = text[position:position+3]
+        self.previous[position % len(self.previous)] = self.head.get(key, -1)
+        self.head[key] = position
+        self.last_2[text[position:position+2]] = position
+        self.last_1[text[position]] = position
+
+
+class BinaryTreeMatchFinder():
+    '''
+    Binary tree match finder (similar to the bt match finder of lzma)
+    The positions in the window are kept in a binary search tree ordered by the text following them
+    (cut at the lookahead size), the newest position is always the root, so every path from the root goes
+    from the closest position to the furthest one.
+    Looking for the match and inserting the new position is done in the same walk down the tree.
+
+    There is no max_chain: the walk has to go down to the bottom of the tree to split it around the new position,
+    stopping early would cut the older positions off the only tree of the window (lzma can, it has one tree per hash),
+    so a limit would lose matches without saving any time
+
+    Complexity
+    Time: O(N * D) where D is the depth of the tree, which is small for most text
+    Space: O(W) for the children of each position in the window
+    '''
+    def __init__(self, text, window_limit_size, lookahead_limit_size, max_chain = None):
+        if max_chain is not None:
+            raise Exception("The binary tree match finder always searches the whole tree, it doesn't take a max_chain")
+        self.text = text
+        self.window_limit_size = window_limit_size
+        self.lookahead_limit_size = lookahead_limit_size
+
+        self.root = -1
+        self.left = array('q', [-1]) * (window_limit_size + 1) #children smaller than the node, cyclic on the window
+        self.right = array('q', [-1]) * (window_limit_size + 1) #children larger than the node, cyclic on the window
+
+    def find(self, position):
+        '''
+        Find the match for the lookahead starting at position, then add position into the window
+        Output: [number_to_look_back, number_to_copy]
+        '''
+        return self.insert(position)
+
+    def find_all(self, position):
+        '''
+        Find every match length for the lookahead starting at position, then add position into the window
+        Output: list of [number_to_copy, number_to_look_back], same as HashChainMatchFinder.find_all
+        '''
+        matches = []
+        self.insert(position, matches)
+        return matches
+
+    def skip(self, position):
+        '''
+        Add position into the window without looking for a match
+        '''
+        self.insert(position)
+
+    def insert(self, position, matches = None):
+        '''
+        Walk down the tree from the root, the path goes through the closest position of every match length.
+        When matches is a list, every strictly longer match found on the way is appended to it
+        '''
+        text = self.text
+        left = self.left
+        right = self.right
+        size = len(left)
+
+        lowest = position - self.window_limit_size
+        key_length = min(self.lookahead_limit_size, len(text) - position)
+        limit = min(self.lookahead_limit_size, len(text) - position - 1) #must leave one character for next_char
+
+        max_value = 0
+        number_to_look_back = 0
+
+        candidate = self.root
+        self.root = position
+
+        #the subtrees where the next smaller or larger node has to be attached, starting with the children of position
+        smaller_tree, smaller_index = left, position % size
+        larger_tree, larger_index = right, position % size
+        smaller_length = 0
+        larger_length = 0
+
+        while candidate >= lowest and candidate >= 0:
+            #everything between the smaller and larger node shares at least the shorter prefix
+            length = smaller_length if smaller_length < larger_length else larger_length
+            if length < key_length and text[candidate+length] == text[position+length]:
+                length = match_length(text, candidate, position, length + 1, key_length)
+
+            if length > max_value and max_value < limit:
+                max_value = length if length < limit else limit
+                number_to_look_back = position - candidate
+                if matches is not None:
+                    matches.append([max_value, number_to_look_back])
+
+            if length == key_length and key_length == self.lookahead_limit_size:
+                #same text as position, the candidate will never be better than position, so take it away from the tree
+                smaller_tree[smaller_index] = left[candidate % size]
+                larger_tree[larger_index] = right[candidate % size]
+                return [number_to_look_back, max_value]
+
+            if length < key_length and text[candidate+length] < text[position+length]:
+                smaller_tree[smaller_index] = candidate
+                smaller_tree, smaller_index = right, candidate % size
+                smaller_length = length
+                candidate = right[candidate % size]
+            else:
+                #the text at position is larger, or it is shorter because it reached the end of the text
+                larger_tree[larger_index] = candidate
+                larger_tree, larger_index = left, candidate % size
+                larger_length = length
+                candidate = left[candidate % size]
+
+        #anything left below is outside of the window
+        smaller_tree[smaller_index] = -1
+        larger_tree[larger_index] = -1
+        return [number_to_look_back, max_value]
+
+
+MATCH_FINDERS = {"hash_chain" : HashChainMatchFinder, "binary_tree" : BinaryTreeMatchFinder}
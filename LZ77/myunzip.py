@@ -1,325 +1,316 @@
+import argparse
 import sys
+import container
+from bitstream import BitReader
 
-def read_binary_file(bin_file_name):
-    input_byte_array = bytearray()
+HUFFMAN_PRIMARY_BITS = 10 #bits looked up at once for the huffman codes, longer codes go through a second table
+ELIAS_TABLE_BITS = 12 #bits looked up at once for the elias codes, longer codes are decoded part by part
 
+def read_binary_file(bin_file_name):
     binfile = open(bin_file_name,'rb')
-    byte_reading = binfile.read(1)
-    while byte_reading:
-        input_byte_array += byte_reading
-        byte_reading = binfile.read(1)
-
+    input_byte_array = binfile.read()
     binfile.close()
 
     return input_byte_array
 
 def write_decoded(filename_array, output_array):
-    filename = ""
-    for char in filename_array:
-        filename = "".join([filename, char])
+    filename = bytes(filename_array).decode()
 
-    output_file =  open(filename, 'w')
-    for char in output_array:
-        output_file.write(char)
+    #the whole output is written at once
+    output_file =  open(filename, 'wb')
+    output_file.write(output_array)
     output_file.close()
 
 
-def decode_bin(bin_file_name):
-    input_byte_array = read_binary_file(bin_file_name)
-    formatted_byte = format_byte(input_byte_array)
-    byte_position = 1 #the first byte is the one i am now processing
-    bit_position = 0
-    formatted_bit = formatted_byte[0]
+def decode_bin(bin_file_name, workers = None):
+    binfile = open(bin_file_name,'rb')
+    is_container = container.is_block_container(binfile.read(len(container.MAGIC)))
+    binfile.close()
+
+    if is_container:
+        decode_block_container(bin_file_name, workers)
+    else:
+        filename_array, output_string = decode_bytes(read_binary_file(bin_file_name))
+        write_decoded(filename_array, output_string)
 
-    #length of the input filename(elias)
-    formatted_bit, bit_position, byte_position, len_input_filename = decode_elias(formatted_bit, bit_position, byte_position,formatted_byte)
 
+def decode_bytes(input_byte_array):
+    '''
+    Decode the bit stream of a .bin file
+    Output: the bytes of the filename, the bytes of the text
+    '''
+    reader = BitReader(input_byte_array)
+    filename_array, number_of_char, huffman_decoder = decode_header(reader)
+    return filename_array, decode_lz77(reader, huffman_decoder, number_of_char)
+
+
+def decode_header(reader):
+    '''
+    Decode the header of a bit stream
+    Output: the bytes of the filename, number of character in the text, huffman lookup table
+    '''
+    #length of the input filename(elias)
+    len_input_filename = decode_elias(reader)
 
-    #decoding the filename(ASCII in 8 bits)
+    #decoding the filename(each byte in 8 bits)
     filename_array = [None] * len_input_filename
     for i in range(len_input_filename):
-        formatted_bit, bit_position, byte_position, ascii_char = decode_ascii(formatted_bit, bit_position, byte_position, formatted_byte)
-        filename_array[i] = chr(ascii_char)
+        filename_array[i] = decode_ascii(reader)
 
     #Total number of character in the file (elias)
-    formatted_bit, bit_position, byte_position, number_of_char = decode_elias(formatted_bit, bit_position, byte_position,formatted_byte)
+    number_of_char = decode_elias(reader)
 
     #Total number of distinct character in the file (elias)
-    formatted_bit, bit_position, byte_position, number_of_uniq_char = decode_elias(formatted_bit, bit_position, byte_position,formatted_byte)
+    number_of_uniq_char = decode_elias(reader)
 
-    #Decoding of all the distinct character, store the huffman encoding into binary search tree
-    huffman_tree = binary_search_tree()
+    #Decoding of all the distinct character, store the huffman encoding into the lookup table
+    huffman_codes = []
     for i in range(number_of_uniq_char):
         #decode ascii char
-        formatted_bit, bit_position, byte_position, ascii_char = decode_ascii(formatted_bit, bit_position, byte_position, formatted_byte)
+        ascii_char = decode_ascii(reader)
 
         #decode the length of the encoding(elias)
-        formatted_bit, bit_position, byte_position, length_of_encode = decode_elias(formatted_bit, bit_position, byte_position,formatted_byte)
+        length_of_encode = decode_elias(reader)
 
         #read the huffman encoding
-        formatted_bit, bit_position, byte_position, huffman_encode = read_n_bits(formatted_bit, bit_position, byte_position, formatted_byte,length_of_encode)
-        
-        #store the huffman_encode
-        huffman_tree.add_into_tree(huffman_encode,ascii_char)
+        huffman_encode = reader.read(length_of_encode)
+        huffman_codes.append((huffman_encode, length_of_encode, ascii_char))
 
+    return filename_array, number_of_char, huffman_lookup_table(huffman_codes)
 
-    #start of lz77
-    output_string = []
+
+def decode_lz77(reader, huffman_decoder, number_of_char):
+    '''
+    Decode the lz77 triples until number_of_char characters are decoded
+    Output: the decoded bytes as a bytearray
+    '''
+    output_string = bytearray()
     number_of_char_decoded = 0
     while number_of_char_decoded < number_of_char:
         #elias, number to go back
-        formatted_bit, bit_position, byte_position, number_to_go_back = decode_elias(formatted_bit, bit_position, byte_position,formatted_byte)
+        number_to_go_back = decode_elias(reader)
 
         #elias, number to copy
-        formatted_bit, bit_position, byte_position, number_to_copy = decode_elias(formatted_bit, bit_position, byte_position,formatted_byte)
+        number_to_copy = decode_elias(reader)
 
         #huffman, what is the next character
-        found_char = False
-        node_now = huffman_tree.root
-        while not found_char:
-            formatted_bit, bit_position, byte_position, tree_position = read_n_bits(formatted_bit, bit_position, byte_position, formatted_byte,1)
-            if tree_position[0] == 1: #go right
-                node_now = node_now.right
-            elif tree_position[1] == 1: # go left
-                node_now = node_now.left
-            
-            if node_now.ascii_char != None:
-                found_char = True
-        
-        next_character = node_now.ascii_char
+        next_character = huffman_decoder.decode(reader)
 
         offset_index = number_of_char_decoded - number_to_go_back
 
-        for i in range(number_to_copy):
-            output_string.append(output_string[offset_index])
-            number_of_char_decoded += 1
-            offset_index += 1
+        if number_to_copy > 0:
+            if number_to_go_back >= number_to_copy:
+                output_string += output_string[offset_index : offset_index + number_to_copy]
+            else:
+                #the copy overlaps the lookahead, so it is the last number_to_go_back characters repeated
+                repeat = output_string[offset_index:]
+                output_string += (repeat * (number_to_copy // number_to_go_back + 1))[:number_to_copy]
+            number_of_char_decoded += number_to_copy
 
         output_string.append(next_character)
         number_of_char_decoded += 1
-    
-    write_decoded(filename_array, output_string)
-    
-
-
-def decode_ascii(formatted_bit, bit_position, byte_position, formatted_byte):
-    #read 8 bits because its ascii character
-    formatted_bit, bit_position, byte_position, result = read_n_bits(formatted_bit, bit_position, byte_position, formatted_byte,8)
-    return formatted_bit, bit_position, byte_position, result[0]
-
-def decode_elias(formatted_bit, bit_position, byte_position, formatted_byte):
-    #read the first bit
-    formatted_bit, bit_position, byte_position, result = read_n_bits(formatted_bit, bit_position, byte_position, formatted_byte,1)
-    value_decoded = None
-
-    #if the first bit is 1
-    if result[0] == 1:
-        value_decoded = 0
-    
-    #it denotes the length, proceed to decode
-    else:
-        while result[1] != 0:
-            #do flipping of MSB here
-            value_to_add = 2 ** (get_bit_length(result[0])+ result[1] - 1)
-            value_of_binary = result[0] + value_to_add + 1 #elias encoding for length is always length - 1
-            formatted_bit, bit_position, byte_position, result = read_n_bits(formatted_bit, bit_position, byte_position, formatted_byte,value_of_binary)
-        value_decoded = result[0] - 1 #since the elias encoding start from 0
-    
-    return formatted_bit, bit_position, byte_position, value_decoded
-
-
-    
-
-def read_n_bits(formatted_bit, bit_position, byte_position, formatted_byte ,number_to_read):
-    #Whether i added a new byte
-    added_new_byte = False
-
-    #check the total length of the formatted_bit
-    total_length = get_bit_length(formatted_bit[0]) + formatted_bit[1]
-
-    #if the last bit to read is out of bound, then concatenate with a new byte
-    while (bit_position + number_to_read - 1) > (total_length - 1):
-        if byte_position > (len(formatted_byte) - 1):
-            raise Exception("No more bytes to read") #which should not happen
-    
-        next_formatted_bit = formatted_byte[byte_position]
-        byte_position += 1
-        formatted_bit = combine_bits(formatted_bit, next_formatted_bit)
-        total_length = get_bit_length(formatted_bit[0]) + formatted_bit[1]
-        added_new_byte = True
-
-
-    result = [0,0]
-    for i in range(number_to_read):
-        bit_processed = read_bit(formatted_bit, bit_position)
-        result = combine_bits(result, bit_processed) #concatenate the bits
-        bit_position += 1
-
 
+    return output_string
 
-    if added_new_byte:
-        total_length = get_bit_length(formatted_bit[0]) + formatted_bit[1]
 
-        #i can take away bits that was read
-        while total_length > 8:
-            if bit_position < 8:
-                raise Exception("First 8 bits was not processed yet")
-
-            formatted_bit = take_away_8bit(formatted_bit) #take away the first 8 bits
-            bit_position -= 8 #reset the position
-            total_length = get_bit_length(formatted_bit[0]) + formatted_bit[1] #update the total length
-
-    
-    return formatted_bit, bit_position, byte_position, result
-
-def take_away_8bit(bit):
+def decode_block(block_arguments):
     '''
-    Make sure that input must be in this form 
-    [value, number of zeros padded to the left]
+    Decode one block of a container, this runs in the worker processes
+    Input: (bytes of the block, None, 0, 0) for a block container, or (bytes of the block, bytes of the bit stream header,
+    bits to skip in the first byte, number of char in the block) for a seekable container
     '''
-    number = bit[0]
-    total_bits = bit[1] + get_bit_length(number)
-
-    #remove the remaining bits that we want to continue with
-    temp = number >> (total_bits - 8)
+    block_byte_array, stream_header, bits_to_skip, number_of_char = block_arguments
+    if stream_header == None:
+        return decode_bytes(block_byte_array)[1]
 
-    #prepare for XOR operation
-    temp = temp << (total_bits - 8)
+    huffman_decoder = decode_header(BitReader(stream_header))[2]
+    reader = BitReader(block_byte_array)
+    reader.skip(bits_to_skip)
+    return decode_lz77(reader, huffman_decoder, number_of_char)
 
-    #take away the first 8 bits with XOR operation
-    number = number ^ temp
-    bits_remaining = total_bits - 8
-    number_of_0_padded = bits_remaining - get_bit_length(number)
-    return [number,number_of_0_padded]
 
-
-def combine_bits(bit_1,bit_2):
+def read_container_blocks(binfile, version, number_of_char, block_index, blocks_to_read):
     '''
-    Make sure that input must be in this form 
-    [value, number of zeros padded to the left]
+    Generator of the arguments of decode_block for each block in blocks_to_read (in order)
     '''
-    value_of_bit_1 = bit_1[0]
-    value_of_bit_2 = bit_2[0]
-    total_bits = get_bit_length(value_of_bit_1) + get_bit_length(value_of_bit_2) + bit_1[1] + bit_2[1]
-
-    #pad to left(including 0s padded to left of bit 2), allowing for concatenation
-    value_of_bit_1 = value_of_bit_1 << (get_bit_length(value_of_bit_2) + bit_2[1]) 
-    value_of_bit_1 = value_of_bit_1 | value_of_bit_2 # concatenate accordingly
-
-    number_of_0_padded = total_bits - get_bit_length(value_of_bit_1)
-    return [value_of_bit_1,number_of_0_padded]
-
-
-def read_bit(formatted_bit, bit_position):
+    data_start = binfile.tell()
+    ranges = container.block_ranges(version, number_of_char, block_index, data_start)
+
+    stream_header = None
+    if version == container.VERSION_SEEKABLE and len(ranges) > 0:
+        #the huffman table is at the start of the bit stream, before the first block
+        stream_header = binfile.read((ranges[0][2] + 7) // 8)
+
+    for block in blocks_to_read:
+        _, block_number_of_char, start, end = ranges[block]
+        if version == container.VERSION_BLOCKS:
+            binfile.seek(start)
+            yield binfile.read(end - start), None, 0, 0
+        else:
+            binfile.seek(data_start + start // 8)
+            byte_count = -1 if end == None else (end + 7) // 8 - start // 8
+            yield binfile.read(byte_count), stream_header, start % 8, block_number_of_char
+
+
+def decode_block_container(bin_file_name, workers = None):
     '''
-    bit_position start from 0
+    Decode a block container or a seekable container (see container.py), the blocks are decoded by a pool of
+    worker processes and written in order
     '''
+    binfile = open(bin_file_name,'rb')
+    version, filename, number_of_char, block_index = container.read_header(binfile)
 
-    bit_length = get_bit_length(formatted_bit[0]) + formatted_bit[1]
-
-
-    if bit_position > bit_length - 1:
-        raise Exception("bit position is out of bound")
+    blocks = read_container_blocks(binfile, version, number_of_char, block_index, range(len(block_index)))
+    output_file = open(filename, 'wb')
+    for _, text_block in container.map_in_order(decode_block, blocks, workers):
+        output_file.write(text_block)
+    output_file.close()
+    binfile.close()
 
-    number_to_compare = 2 ** (bit_length - bit_position - 1)
 
-    answer =  number_to_compare & formatted_bit[0]
+def read_range(bin_file_name, start, length):
+    '''
+    Decode only the characters from start to start + length of an encoded file
+    With a block container or a seekable container, only the blocks holding these characters are read and decoded,
+    an original .bin file has no index so it is decoded completely
+    Output: the bytes
+    '''
+    binfile = open(bin_file_name,'rb')
+    if not container.is_block_container(binfile.read(len(container.MAGIC))):
+        binfile.close()
+        return bytes(decode_bytes(read_binary_file(bin_file_name))[1][start:start + length])
 
-    if answer == 0:
-        return [0,1]
-    elif answer == number_to_compare:
-        return [1,0]
-    else:
-        raise Exception("Something wrong when reading the bit")
+    binfile.seek(0)
+    version, filename, number_of_char, block_index = container.read_header(binfile)
+    ranges = container.block_ranges(version, number_of_char, block_index, binfile.tell())
 
+    end = min(start + length, number_of_char)
+    blocks_to_read = [block for block in range(len(ranges)) if ranges[block][0] < end and ranges[block][0] + ranges[block][1] > start]
 
-def get_bit_length(number):
-    length_of_bit = 0
-    while number > 0:
-        length_of_bit += 1
-        number = number // 2
-    return length_of_bit
+    output_string = []
+    for block_arguments in read_container_blocks(binfile, version, number_of_char, block_index, blocks_to_read):
+        output_string.append(decode_block(block_arguments))
+    binfile.close()
 
+    if len(blocks_to_read) == 0:
+        return b""
+    first_char = ranges[blocks_to_read[0]][0]
+    return b"".join(output_string)[start - first_char : end - first_char]
 
-def format_byte(input_byte_array):
-    formatted_byte = []
-    for byte in input_byte_array:
-        number_of_0_padded = 8 - get_bit_length(byte)
-        formatted_byte.append([byte, number_of_0_padded])
-    return formatted_byte
 
 
-class binary_node():
-    def __init__(self):
-        self.ascii_char = None
-        self.left = None
-        self.right = None 
+def decode_ascii(reader):
+    #read 8 bits because its ascii character
+    return reader.read(8)
 
-class binary_search_tree():
+def decode_elias(reader):
     '''
-    A standard binary search tree to store the huffman encoding
+    Decode an elias encoding, short encodings are a single lookup in the elias table
     '''
-    def __init__(self):
-        self.root = binary_node()
-    
-    def add_into_tree(self, huffman_encoding, ascii_char_rep):
-        node_now = self.root
-        total_bit_length = get_bit_length(huffman_encoding[0]) + huffman_encoding[1]
-        position_array = []
-        for i in range(total_bit_length):
-            result = read_bit(huffman_encoding,i)
-            if result[0] == 1:
-                position_array.append(1)
-            elif result[1] == 1:
-                position_array.append(0)
-        for i in position_array:
-            if i == 1:
-                if node_now.right == None:
-                    node_now.right = binary_node()
-                node_now = node_now.right
-            elif i == 0:
-                if node_now.left == None:
-                    node_now.left = binary_node()
-                node_now = node_now.left
-            else:
-                raise Exception("Unknown input")
-        
-        if node_now.ascii_char != None:
-            raise Exception("Something is wrong with encoding")
-        
-        node_now.ascii_char = chr(ascii_char_rep)
-        
-    def search_encoding(self, huffman_encoding):
-        node_now = self.root
-        total_bit_length = get_bit_length(huffman_encoding[0]) + huffman_encoding[1]
-        position_array = []
-        for i in range(total_bit_length):
-            result = read_bit(huffman_encoding,i)
-            if result[0] == 1:
-                position_array.append(1)
-            elif result[1] == 1:
-                position_array.append(0)
-
-        for i in position_array:
-            if i == 1:
-                if node_now.right == None:
-                    raise Exception("Right node is none")
-                node_now = node_now.right
-            elif i == 0:
-                if node_now.left == None:
-                    raise Exception("Left node is none")
-                node_now = node_now.left
+    value_decoded, bits_used = ELIAS_TABLE[reader.peek(ELIAS_TABLE_BITS)]
+    if bits_used > 0:
+        reader.skip(bits_used)
+        return value_decoded
+
+    #longer than the table, decode each part, a part starting with 0 denotes the length of the next part
+    length = 1
+    value = reader.read(1)
+    while value < (1 << (length - 1)):
+        #do flipping of MSB here, elias encoding for length is always length - 1
+        length = (value | (1 << (length - 1))) + 1
+        value = reader.read(length)
+    return value - 1 #since the elias encoding start from 0
+
+
+def build_elias_table(table_bits):
+    '''
+    For every possible table_bits long prefix, the decoded value and the number of bits it uses
+    (0 bits used means the encoding is longer than the prefix)
+    '''
+    table = [(0, 0)] * (1 << table_bits)
+    for prefix in range(1 << table_bits):
+        length = 1
+        bits_used = 1
+        value = prefix >> (table_bits - 1)
+        while value < (1 << (length - 1)):
+            length = (value | (1 << (length - 1))) + 1
+            if bits_used + length > table_bits:
+                break
+            value = (prefix >> (table_bits - bits_used - length)) & ((1 << length) - 1)
+            bits_used += length
+        else:
+            table[prefix] = (value - 1, bits_used)
+    return table
+
+ELIAS_TABLE = build_elias_table(ELIAS_TABLE_BITS)
+
+
+class huffman_lookup_table():
+    '''
+    Decode a huffman encoding with a lookup instead of going through the tree bit by bit
+
+    The primary table is indexed by the next primary_bits bits, an entry is (character, length of the encoding).
+    Encodings longer than primary_bits share an entry holding (second table, -bits of the second table),
+    the second table is indexed by the bits after the primary ones
+    '''
+    def __init__(self, huffman_codes, primary_bits = HUFFMAN_PRIMARY_BITS):
+        '''
+        huffman_codes is a list of (encoding, length of the encoding, character)
+        '''
+        longest = max([length for _, length, _ in huffman_codes], default = 1)
+        self.primary_bits = min(primary_bits, longest)
+        self.primary = [None] * (1 << self.primary_bits)
+
+        #group the long encodings by their first primary_bits bits
+        overflow = {}
+        for encoding, length, char in huffman_codes:
+            if length <= self.primary_bits:
+                first = encoding << (self.primary_bits - length)
+                for index in range(first, first + (1 << (self.primary_bits - length))):
+                    if self.primary[index] != None:
+                        raise Exception("Something is wrong with encoding")
+                    self.primary[index] = (char, length)
             else:
+                prefix = encoding >> (length - self.primary_bits)
+                overflow.setdefault(prefix, []).append((encoding, length, char))
+
+        for prefix, codes in overflow.items():
+            if self.primary[prefix] != None:
+                raise Exception("Something is wrong with encoding")
+            second_bits = max([length for _, length, _ in codes]) - self.primary_bits
+            second = [None] * (1 << second_bits)
+            for encoding, length, char in codes:
+                rest_length = length - self.primary_bits
+                first = (encoding & ((1 << rest_length) - 1)) << (second_bits - rest_length)
+                for index in range(first, first + (1 << (second_bits - rest_length))):
+                    if second[index] != None:
+                        raise Exception("Something is wrong with encoding")
+                    second[index] = (char, length)
+            self.primary[prefix] = (second, -second_bits)
+
+    def decode(self, reader):
+        entry = self.primary[reader.peek(self.primary_bits)]
+        if entry == None:
+            raise Exception("Unknown input")
+
+        if entry[1] < 0:
+            second_bits = -entry[1]
+            entry = entry[0][reader.peek(self.primary_bits + second_bits) & ((1 << second_bits) - 1)]
+            if entry == None:
                 raise Exception("Unknown input")
-        
-        if node_now.ascii_char == None:
-            raise Exception("Something is wrong with encoding")
-        
-        return node_now.ascii_char
 
-        
+        reader.skip(entry[1])
+        return entry[0]
+
+
 if __name__ == "__main__":
-    text_file_name = sys.argv[1]
-    decode_bin(text_file_name)
-    
-    
+    parser = argparse.ArgumentParser(description = "Decode a file encoded by myzip.py")
+    parser.add_argument("filename")
+    parser.add_argument("--workers", type = int, default = None, help = "number of processes decoding the blocks of a block container")
+    parser.add_argument("--range", type = int, nargs = 2, metavar = ("START", "LENGTH"), help = "print only these characters instead of writing the decoded file")
+    args = parser.parse_args()
+
+    if args.range is not None:
+        sys.stdout.buffer.write(read_range(args.filename, args.range[0], args.range[1]))
+    else:
+        decode_bin(args.filename, args.workers)
@@ -1,4 +1,31 @@
-import sys
+import argparse
+import mmap
+import os
+from array import array
+from collections import Counter
+from functools import lru_cache
+import container
+from bitstream import BitWriter
+from match_finder import MATCH_FINDERS
+
+STREAM_BLOCK_SIZE = 1 << 16 #number of characters encoded per block in streaming mode
+PARALLEL_BLOCK_SIZE = 1 << 20 #number of characters in each block of a block container
+SEEK_BLOCK_SIZE = 1 << 16 #number of characters in each block of a seekable container
+
+#compression level -> (parse, max_chain of the match finder), like the levels of zlib from fastest to smallest
+#without a level, the parse is greedy with no limit on the match finder, which gives the same triples as the z algorithm
+#the binary tree has no max_chain (see match_finder.py), it always finds the longest matches
+COMPRESSION_LEVELS = {
+    1 : ("greedy", 4),
+    2 : ("greedy", 16),
+    3 : ("greedy", 64),
+    4 : ("lazy", 16),
+    5 : ("lazy", 64),
+    6 : ("lazy", None),
+    7 : ("optimal", 16),
+    8 : ("optimal", 64),
+    9 : ("optimal", None),
+}
 
 def write_into_bin_file(byte_array, filename):
     filename = filename + ".bin"
@@ -6,94 +33,193 @@ def write_into_bin_file(byte_array, filename):
     output_file.write(byte_array)
     output_file.close()
 
-def compress_txt_file(txt_file_name, window_limit_size, lookahead_limit_size):
-    text_sample = read_input(txt_file_name)
+def compress_txt_file(txt_file_name, window_limit_size, lookahead_limit_size, match_finder = "hash_chain", level = None):
+    with read_input(txt_file_name) as text_sample: #the mapping of the file is closed once it is encoded
+        byte_array = compress_text(text_sample, txt_file_name, window_limit_size, lookahead_limit_size, match_finder, level)
+
+    #write into binary file
+    write_into_bin_file(byte_array, txt_file_name)
+
+
+def compress_text(text_sample, txt_file_name, window_limit_size, lookahead_limit_size, match_finder = "hash_chain", level = None):
+    '''
+    Encode a text into the bytes of a .bin file
+    '''
     freq_array = find_frequency_of_ascii(text_sample)
     huffman_encoded_array = huffman_encode(freq_array)
-    output_byte_array = bytearray()
-    output_formatted_bit = []
+    writer = BitWriter()
 
     #header_encoding
+    write_header(writer, txt_file_name, len(text_sample), freq_array, huffman_encoded_array)
 
-    #file_length
-    file_length_encoding = elias(len(txt_file_name))
-    output_formatted_bit.append(file_length_encoding)
+    #data encoding 
+    lz77_output = lz77(text_sample, window_limit_size, lookahead_limit_size, match_finder, level, huffman_encoded_array)
+    write_lz77(writer, lz77_output, huffman_encoded_array)
 
-    #each of the ascii in the filename
-    for char in txt_file_name:
-        output_formatted_bit.append(convert_ascii_to_bit(ord(char)))
+    #the last byte is padded with 0s by the writer
+    return writer.getvalue()
 
-    #encode the number of character in the file
-    output_formatted_bit.append(elias(len(text_sample)))
 
-    #encode the number of distict char in the file
-    no_uniq_char = find_distict_char(freq_array)
-    output_formatted_bit.append(elias(no_uniq_char))
+def compress_block(block_arguments):
+    '''
+    Encode one block of a block container, this runs in the worker processes
+    Input: (text of the block, window size, lookahead size, match finder, compression level)
+    Output: the bit stream of the block (with an empty filename)
+    '''
+    text_block, window_limit_size, lookahead_limit_size, match_finder, level = block_arguments
+    return compress_text(text_block, "", window_limit_size, lookahead_limit_size, match_finder, level)
 
-    #encode the distinct character with their huffman encoding
-    output_formatted_bit = find_huffman_encode(huffman_encoded_array, output_formatted_bit)
 
+def compress_txt_file_parallel(txt_file_name, window_limit_size, lookahead_limit_size, match_finder = "hash_chain", workers = None, block_size = PARALLEL_BLOCK_SIZE, level = None):
+    '''
+    Encode the file into a block container (see container.py), the blocks are encoded by a pool of worker processes
+    Only a few blocks per worker are read ahead, and the encoded blocks are written in order as soon as they are ready,
+    the block index is filled in at the end
+    '''
+    number_of_char = os.path.getsize(txt_file_name)
+    if number_of_char == 0:
+        raise Exception(f"{txt_file_name} is empty, there is nothing to encode")
+    number_of_blocks = (number_of_char + block_size - 1) // block_size
+    block_index = []
+
+    output_file = open(txt_file_name + ".bin", 'wb')
+    output_file.write(bytes(container.header_size(txt_file_name, number_of_blocks))) #filled in once the block lengths are known
+
+    txtfile = open(txt_file_name,'rb')
+    blocks = iter(lambda: txtfile.read(block_size), b"")
+    for block_arguments, compressed_block in container.map_in_order(compress_block, ((text_block, window_limit_size, lookahead_limit_size, match_finder, level) for text_block in blocks), workers):
+        output_file.write(compressed_block)
+        block_index.append((len(compressed_block), len(block_arguments[0])))
+    txtfile.close()
 
-    #data encoding 
-    lz77_output = lz77(text_sample, window_limit_size, lookahead_limit_size)
-    lz77_modified = format_lz77(lz77_output, huffman_encoded_array)
+    output_file.seek(0)
+    output_file.write(container.pack_header(txt_file_name, number_of_char, block_index))
+    output_file.close()
 
-    for triple in lz77_modified:
-        for formatted_bit in triple:
-            output_formatted_bit.append(formatted_bit)
-    
 
-    #now to throw all these to bytearray
+def compress_txt_file_seekable(txt_file_name, window_limit_size, lookahead_limit_size, match_finder = "hash_chain", block_size = SEEK_BLOCK_SIZE, level = None):
+    '''
+    Encode the file into a seekable container (see container.py), any block can then be decoded without the ones before it
+    All the blocks share the huffman table of the whole file, the lz77 window starts again at every block,
+    and the bit offset of every block is saved into the index
+    '''
+    freq_array, number_of_char = find_frequency_of_file(txt_file_name, block_size)
+    huffman_encoded_array = huffman_encode(freq_array)
+    number_of_blocks = (number_of_char + block_size - 1) // block_size
+    block_index = []
+
+    output_file = open(txt_file_name + ".bin", 'wb')
+    output_file.write(bytes(container.header_size(txt_file_name, number_of_blocks))) #filled in once the bit offsets are known
+
+    #header of the bit stream, with the huffman table
+    writer = BitWriter()
+    write_header(writer, "", number_of_char, freq_array, huffman_encoded_array)
+
+    txtfile = open(txt_file_name,'rb')
+    first_char = 0
+    text_block = txtfile.read(block_size)
+    while text_block:
+        block_index.append((writer.bit_count, first_char))
+        write_lz77(writer, lz77(text_block, window_limit_size, lookahead_limit_size, match_finder, level, huffman_encoded_array), huffman_encoded_array)
+        writer.flush_bytes(output_file)
+
+        first_char += len(text_block)
+        text_block = txtfile.read(block_size)
+    txtfile.close()
 
-    #combine all the bits 
-    
-    concat_bits = [0,0]
-    for bit_index in range(len(output_formatted_bit)):
-        
-        concat_bits = combine_bits(concat_bits, output_formatted_bit[bit_index])
+    #the last byte is padded with 0s by the writer
+    output_file.write(writer.getvalue())
 
-        #if the length of the bits are more than 8 bits, append them into byte array
-        total_bit_length = get_bit_length(concat_bits[0]) + concat_bits[1]
+    output_file.seek(0)
+    output_file.write(container.pack_header(txt_file_name, number_of_char, block_index, container.VERSION_SEEKABLE))
+    output_file.close()
 
-        if total_bit_length >= 8:
-            concat_bits, output_byte_array = take_away_8bit(concat_bits, output_byte_array)
 
-    #cases where i still have more than 8 bits after the last iteration
-    total_bit_length = get_bit_length(concat_bits[0]) + concat_bits[1]
-    while total_bit_length >= 8:
-        concat_bits, output_byte_array = take_away_8bit(concat_bits, output_byte_array)
-        total_bit_length = get_bit_length(concat_bits[0]) + concat_bits[1]
+def compress_txt_file_streaming(txt_file_name, window_limit_size, lookahead_limit_size, match_finder = "hash_chain", block_size = STREAM_BLOCK_SIZE, level = None):
+    '''
+    Same output as compress_txt_file, but the text is never fully in memory
+    The first pass over the file counts the characters (needed by the header), the second pass runs lz77
+    block by block and writes the bytes into the output file as soon as they are ready.
+    Memory is bounded by window + block + lookahead, whatever the size of the file
+    '''
+    freq_array, number_of_char = find_frequency_of_file(txt_file_name, block_size)
+    huffman_encoded_array = huffman_encode(freq_array)
+    writer = BitWriter()
 
-    #still have some bits, now to pad extra 0s
-    total_bit_length = get_bit_length(concat_bits[0]) + concat_bits[1]
-    if total_bit_length > 0 :
-        concat_bits[0] = concat_bits[0] << (8 - total_bit_length) #pad extra 0 to the left
-        output_byte_array.append(concat_bits[0])
+    output_file = open(txt_file_name + ".bin", 'wb')
 
-    #write into binary file
-    write_into_bin_file(output_byte_array,txt_file_name)
-    
+    #header_encoding
+    write_header(writer, txt_file_name, number_of_char, freq_array, huffman_encoded_array)
 
+    #data encoding, one block at a time
+    for lz77_output in lz77_stream(txt_file_name, number_of_char, window_limit_size, lookahead_limit_size, match_finder, block_size, level, huffman_encoded_array):
+        write_lz77(writer, lz77_output, huffman_encoded_array)
+        writer.flush_bytes(output_file)
 
-def find_huffman_encode(huffman_encoded_array, output_formatted_bit):
+    #the last byte is padded with 0s by the writer
+    output_file.write(writer.getvalue())
+    output_file.close()
+
+
+def write_header(writer, txt_file_name, number_of_char, freq_array, huffman_encoded_array):
+    #file_length
+    filename_bytes = txt_file_name.encode()
+    writer.write(*elias_bits(len(filename_bytes)))
+
+    #each of the byte in the filename
+    for char in filename_bytes:
+        writer.write(char, 8)
+
+    #encode the number of character in the file
+    writer.write(*elias_bits(number_of_char))
+
+    #encode the number of distict char in the file
+    no_uniq_char = find_distict_char(freq_array)
+    writer.write(*elias_bits(no_uniq_char))
+
+    #encode the distinct character with their huffman encoding
+    find_huffman_encode(huffman_encoded_array, writer)
+
+
+def write_lz77(writer, lz77_output, huffman_encoded_array):
+    #the bit length of every huffman code is only computed once
+    huffman_lengths = huffman_code_lengths(huffman_encoded_array)
+    huffman_bits = [None] * len(huffman_encoded_array)
+    for ascii_char in range(len(huffman_encoded_array)):
+        if huffman_encoded_array[ascii_char] != None:
+            huffman_bits[ascii_char] = (huffman_encoded_array[ascii_char][0], huffman_lengths[ascii_char])
+
+    for number_to_look_back, number_to_copy, next_char in lz77_output:
+        writer.write(*elias_bits(number_to_look_back))
+        writer.write(*elias_bits(number_to_copy))
+        writer.write(*huffman_bits[next_char])
+
+
+def huffman_code_lengths(huffman_encoded_array):
+    '''
+    Bit length of the huffman encoding of every ascii (None for the ones not in the text)
+    '''
+    huffman_lengths = [None] * len(huffman_encoded_array)
+    for ascii_char in range(len(huffman_encoded_array)):
+        if huffman_encoded_array[ascii_char] != None:
+            huffman_lengths[ascii_char] = get_bit_length(huffman_encoded_array[ascii_char][0]) + huffman_encoded_array[ascii_char][1]
+    return huffman_lengths
+
+
+def find_huffman_encode(huffman_encoded_array, writer):
     for array in range(len(huffman_encoded_array)):
         if huffman_encoded_array[array] == None:
             continue
         else:
             #the encoding of ascii bit
-            character_bit = convert_ascii_to_bit(array)
-            output_formatted_bit.append(character_bit)
+            writer.write(array, 8)
 
             #the encoding of the length of the huffman encoding
             length_of_bit = get_bit_length(huffman_encoded_array[array][0]) + huffman_encoded_array[array][1]
-            length_bit = elias(length_of_bit)
-            output_formatted_bit.append(length_bit)
+            writer.write(*elias_bits(length_of_bit))
 
             #the huffman encoding
-            encoded_char_bit = huffman_encoded_array[array]
-            output_formatted_bit.append(encoded_char_bit)
-    
-    return output_formatted_bit
+            writer.write(huffman_encoded_array[array][0], length_of_bit)
 
 
 def find_distict_char(frequency_array):
@@ -104,49 +230,87 @@ def find_distict_char(frequency_array):
     return ret_val
 
 def read_input(file_name):
-    txtfile = open(file_name,'r')
-    txt = txtfile.read()
-    txtfile.close()
+    '''
+    The bytes of the file, mapped into memory so nothing is copied, any file (text or binary) can be encoded
+    '''
+    txtfile = open(file_name,'rb')
+    if os.fstat(txtfile.fileno()).st_size == 0:
+        txtfile.close()
+        raise Exception(f"{file_name} is empty, there is nothing to encode")
+    txt = mmap.mmap(txtfile.fileno(), 0, access = mmap.ACCESS_READ)
+    txtfile.close() #the mapping stays valid after closing the file
     return txt
 
-def find_frequency_of_ascii(txt_from_file):
-    frequency_table = [0] * 256
-    for char in txt_from_file:
-        frequency_table[ord(char)] += 1
+def find_frequency_of_ascii(txt_from_file, frequency_table = None):
+    if frequency_table == None:
+        frequency_table = [0] * 256
+    #counting over a memoryview gives the value of every byte, and Counter does the loop in C
+    for char, frequency in Counter(memoryview(txt_from_file)).items():
+        frequency_table[char] += frequency
     return frequency_table
-    
 
-def convert_ascii_to_bit(ascii_number):
-    length_of_number = get_bit_length(ascii_number)
-    number_of_0_padded = 8 - length_of_number
-    return [ascii_number,number_of_0_padded]
+def find_frequency_of_file(file_name, block_size):
+    '''
+    Frequency of each ascii and the number of character of a file, reading it block by block
+    '''
+    frequency_table = [0] * 256
+    number_of_char = 0
+    txtfile = open(file_name,'rb')
+    block = txtfile.read(block_size)
+    while block:
+        find_frequency_of_ascii(block, frequency_table)
+        number_of_char += len(block)
+        block = txtfile.read(block_size)
+    txtfile.close()
+    if number_of_char == 0:
+        raise Exception(f"{file_name} is empty, there is nothing to encode")
+    return frequency_table, number_of_char
+    
 
 def get_bit_length(number):
     '''
     Get the bit length of a value (in binary)
     '''
-    length_of_bit = 0
-    while number > 0:
-        length_of_bit += 1
-        number = number // 2
-    return length_of_bit
+    return number.bit_length() if number > 0 else 0
 
-def format_lz77(output_from_lz77, huffman_encoding_array):
-    for index in range(len(output_from_lz77)):
-        array_to_format = output_from_lz77[index]
-        array_to_format[0] = elias(array_to_format[0])
-        array_to_format[1] = elias(array_to_format[1])
-        array_to_format[2] = huffman_encoding_array[ord(array_to_format[2])]
+def level_options(level, match_finder):
+    '''
+    (parse, max_chain) of a compression level for match_finder, greedy with no limit without a level
+    '''
+    if level is None:
+        return "greedy", None
+    parse, max_chain = COMPRESSION_LEVELS[level]
+    return parse, max_chain if match_finder != "binary_tree" else None
+
+def lz77(txt_from_file, window_limit_size, lookahead_limit_size, match_finder = "hash_chain", level = None, huffman_encoded_array = None):
+    '''
+    Produce the [number_to_look_back, number_to_copy, next_char] triples of the text
+    match_finder is "z" for the z algorithm, or one of the match finders in match_finder.py,
+    all of them give the same triples
+    level is one of COMPRESSION_LEVELS, the optimal parse uses the huffman encoding of the text to know the
+    cost of each triple (it is computed from the text when not given)
+    '''
+    if len(txt_from_file) == 0:
+        return []
+
+    if level is not None:
+        if match_finder == "z":
+            raise Exception("Compression levels need a match finder, the z algorithm only does the greedy parse")
+        parse, max_chain = level_options(level, match_finder)
+        if parse == "optimal" and huffman_encoded_array is None:
+            huffman_encoded_array = huffman_encode(find_frequency_of_ascii(txt_from_file))
+        finder = MATCH_FINDERS[match_finder](txt_from_file, window_limit_size, lookahead_limit_size, max_chain)
+        return lz77_match_finder(txt_from_file, finder, PARSERS[parse], huffman_encoded_array)
 
-    return output_from_lz77
+    if match_finder != "z":
+        return lz77_match_finder(txt_from_file, MATCH_FINDERS[match_finder](txt_from_file, window_limit_size, lookahead_limit_size))
 
-def lz77(txt_from_file, window_limit_size, lookahead_limit_size):
     output_array = []
     output_array.append([0,0,txt_from_file[0]])
     window_pointer = 0
     window_size = 1
     
-    done = False
+    done = len(txt_from_file) == 1
 
     while not done:
 
@@ -161,10 +325,13 @@ def lz77(txt_from_file, window_limit_size, lookahead_limit_size):
         index_to_start = len(look_slice)
 
 
-        max_index, number_to_look_back = find_max(z_array, index_to_start, window_size, lookahead_limit_size)
+        #leave at least one character for next_char when the lookahead reaches the end of the text
+        copy_limit = min(lookahead_limit_size, len(txt_from_file) - (window_pointer+window_size) - 1)
 
+        max_index, number_to_look_back = find_max(z_array, index_to_start, window_size, copy_limit)
 
-        number_to_copy = min(z_array[max_index], lookahead_limit_size)
+
+        number_to_copy = min(z_array[max_index], copy_limit)
 
         if number_to_copy < 1:
             number_to_look_back = 0
@@ -196,6 +363,183 @@ def lz77(txt_from_file, window_limit_size, lookahead_limit_size):
     return output_array
 
 
+def lz77_match_finder(txt_from_file, finder, parser = None, huffman_encoded_array = None):
+    '''
+    Same as lz77 but the matches come from a match finder instead of running the z algorithm at every step
+    Input: text, match finder built on the text, one of PARSERS (greedy when None), huffman encoding for the optimal parse
+    Output: array of [number_to_look_back, number_to_copy, next_char]
+    '''
+    output_array = []
+    output_array.append([0,0,txt_from_file[0]])
+    finder.skip(0)
+
+    (parser or lz77_segment)(txt_from_file, finder, 1, len(txt_from_file), output_array, huffman_encoded_array)
+    return output_array
+
+
+def lz77_segment(txt_from_file, finder, start_of_lookahead, end_of_segment, output_array, huffman_encoded_array = None):
+    '''
+    Greedy parse, the longest match is always taken
+    Append the triples of every lookahead starting before end_of_segment into output_array
+    The positions before start_of_lookahead must already be in the match finder
+    Output: start of the next lookahead (the last match can go past end_of_segment)
+    '''
+    while start_of_lookahead < end_of_segment:
+        number_to_look_back, number_to_copy = finder.find(start_of_lookahead)
+        output_array.append([number_to_look_back, number_to_copy, txt_from_file[start_of_lookahead + number_to_copy]])
+
+        #the copied characters still have to go into the window
+        for position in range(start_of_lookahead + 1, start_of_lookahead + number_to_copy + 1):
+            finder.skip(position)
+
+        start_of_lookahead += number_to_copy + 1
+
+    return start_of_lookahead
+
+
+def lz77_lazy_segment(txt_from_file, finder, start_of_lookahead, end_of_segment, output_array, huffman_encoded_array = None):
+    '''
+    Lazy parse (like zlib), before taking a match the match of the next position is looked at as well.
+    If it is longer, the character is sent on its own as [0,0,char] and the longer match is taken instead
+    Same input and output as lz77_segment
+    '''
+    current = finder.find(start_of_lookahead) if start_of_lookahead < end_of_segment else None
+    while start_of_lookahead < end_of_segment:
+        number_to_look_back, number_to_copy = current
+        inserted = start_of_lookahead + 1 #positions before this one are in the match finder
+
+        if number_to_copy > 0 and start_of_lookahead + 1 < len(txt_from_file):
+            following = finder.find(start_of_lookahead + 1)
+            inserted += 1
+            if following[1] > number_to_copy:
+                output_array.append([0, 0, txt_from_file[start_of_lookahead]])
+                start_of_lookahead += 1
+                current = following
+                continue
+
+        output_array.append([number_to_look_back, number_to_copy, txt_from_file[start_of_lookahead + number_to_copy]])
+
+        #the copied characters still have to go into the window
+        for position in range(inserted, start_of_lookahead + number_to_copy + 1):
+            finder.skip(position)
+
+        start_of_lookahead += number_to_copy + 1
+        if start_of_lookahead < end_of_segment:
+            current = finder.find(start_of_lookahead)
+
+    return start_of_lookahead
+
+
+def lz77_optimal_segment(txt_from_file, finder, start_of_lookahead, end_of_segment, output_array, huffman_encoded_array):
+    '''
+    Optimal parse, the triples with the smallest number of bits in total are found by dynamic programming.
+    Every position is a node, and every match length of every position is an edge to the position after its
+    next_char, weighted by the real bit length of the triple (elias of both numbers and huffman of next_char).
+    The triples stop exactly at end_of_segment
+    Same input and output as lz77_segment
+
+    Complexity
+    Time: O(N * L) where L is the lookahead size, every match length of every position is tried
+    Space: O(N) for the cost and the choice of every position
+    '''
+    huffman_lengths = huffman_code_lengths(huffman_encoded_array)
+    segment_length = end_of_segment - start_of_lookahead
+    literal_bits = elias_bits(0)[1] * 2
+
+    #cost[i] is the smallest number of bits to reach start_of_lookahead + i
+    cost = [0] + [float("inf")] * segment_length
+    chosen_copy = array('q', [0]) * (segment_length + 1)
+    chosen_look_back = array('q', [0]) * (segment_length + 1)
+    copy_bits = [] #bit length of the elias encoding of every number_to_copy
+
+    for index in range(segment_length):
+        position = start_of_lookahead + index
+        matches = finder.find_all(position)
+        base = cost[index]
+
+        if base + literal_bits + huffman_lengths[txt_from_file[position]] < cost[index + 1]:
+            cost[index + 1] = base + literal_bits + huffman_lengths[txt_from_file[position]]
+            chosen_copy[index + 1] = 0
+            chosen_look_back[index + 1] = 0
+
+        #the closest match of each length is the cheapest one, as the elias encoding never gets shorter with the number
+        longest = min(matches[-1][0], segment_length - index - 1) if matches else 0
+        while len(copy_bits) <= longest:
+            copy_bits.append(elias_bits(len(copy_bits))[1])
+
+        match_index = 0
+        number_to_look_back = matches[0][1] if matches else 0
+        look_back_bits = base + elias_bits(number_to_look_back)[1]
+        for number_to_copy in range(1, longest + 1):
+            if matches[match_index][0] < number_to_copy:
+                match_index += 1
+                number_to_look_back = matches[match_index][1]
+                look_back_bits = base + elias_bits(number_to_look_back)[1]
+            total = look_back_bits + copy_bits[number_to_copy] + huffman_lengths[txt_from_file[position + number_to_copy]]
+            if total < cost[index + number_to_copy + 1]:
+                cost[index + number_to_copy + 1] = total
+                chosen_copy[index + number_to_copy + 1] = number_to_copy
+                chosen_look_back[index + number_to_copy + 1] = number_to_look_back
+
+    #walk back from the end of the segment
+    triples = []
+    index = segment_length
+    while index > 0:
+        number_to_copy = chosen_copy[index]
+        triples.append([chosen_look_back[index], number_to_copy, txt_from_file[start_of_lookahead + index - 1]])
+        index -= number_to_copy + 1
+    triples.reverse()
+    output_array.extend(triples)
+
+    return end_of_segment
+
+
+PARSERS = {"greedy" : lz77_segment, "lazy" : lz77_lazy_segment, "optimal" : lz77_optimal_segment}
+
+
+def lz77_stream(txt_file_name, number_of_char, window_limit_size, lookahead_limit_size, match_finder, block_size, level = None, huffman_encoded_array = None):
+    '''
+    Generator of the lz77 triples of a file, one array of triples per block
+    Only the window before the block, the block and the lookahead after it are kept in memory.
+    The match finder is rebuilt for every block from the window, which gives the same triples as
+    running it over the whole text (except for the optimal parse, which stops at the end of every block)
+    '''
+    if match_finder == "z":
+        raise Exception("Streaming mode needs a match finder, the z algorithm works on the whole text")
+
+    parse, max_chain = level_options(level, match_finder)
+
+    txtfile = open(txt_file_name,'rb')
+    buffer = b"" #text from buffer_start onwards
+    buffer_start = 0
+    start_of_lookahead = 0
+
+    while start_of_lookahead < number_of_char:
+        #the lookahead of the last position of the block must be complete so that the matches are the same as on the whole text
+        end_of_segment = min(start_of_lookahead + block_size, number_of_char)
+        end_of_buffer = min(end_of_segment + lookahead_limit_size + 1, number_of_char)
+        buffer += txtfile.read(end_of_buffer - buffer_start - len(buffer))
+
+        output_array = []
+        finder = MATCH_FINDERS[match_finder](buffer, window_limit_size, lookahead_limit_size, max_chain)
+        for position in range(0, start_of_lookahead - buffer_start):
+            finder.skip(position)
+
+        if start_of_lookahead == 0:
+            output_array.append([0,0,buffer[0]])
+            finder.skip(0)
+            start_of_lookahead = 1
+
+        start_of_lookahead = buffer_start + PARSERS[parse](buffer, finder, start_of_lookahead - buffer_start, end_of_segment - buffer_start, output_array, huffman_encoded_array)
+        yield output_array
+
+        #only keep the window for the next block
+        new_buffer_start = max(start_of_lookahead - window_limit_size, buffer_start)
+        buffer = buffer[new_buffer_start - buffer_start:]
+        buffer_start = new_buffer_start
+
+    txtfile.close()
+
 
 def find_max(z_array, index_to_start, window_size, lookahead_limit_size):
     max_value = 0
@@ -225,6 +569,19 @@ def find_max(z_array, index_to_start, window_size, lookahead_limit_size):
 
     
 def elias(number_to_encode):
+    '''
+    Elias encoding in the form [value, number of zeros padded to the left]
+    '''
+    combined_bits, bit_length = elias_bits(number_to_encode)
+    return [combined_bits, bit_length - get_bit_length(combined_bits)]
+
+
+@lru_cache(maxsize=None)
+def elias_bits(number_to_encode):
+    '''
+    Elias encoding as (value, bit length), the numbers encoded are bounded by the window and lookahead
+    so they are cached
+    '''
     number_offset = number_to_encode + 1
     bit_pointer = get_bit_length(number_offset) # bit pointer stores how many bits this encoding uses
     combined_bits = number_offset #init value, the number to encode
@@ -237,7 +594,7 @@ def elias(number_to_encode):
         number_offset = length_of_offset
 
         #do flipping of MSB here
-        value_to_minus = 2 ** (get_bit_length(length_of_offset)-1)
+        value_to_minus = 1 << (get_bit_length(length_of_offset)-1)
         padded_offset = length_of_offset - value_to_minus
 
         #Padding of bits to the left
@@ -247,51 +604,7 @@ def elias(number_to_encode):
         #OR operation to concatenate bits
         combined_bits = padded_offset | combined_bits
 
-    number_of_0_padded = bit_pointer - get_bit_length(combined_bits)
-    return [combined_bits, number_of_0_padded]
-
-
-def combine_bits(bit_1,bit_2):
-    '''
-    A function to combine 2 bits together
-    Make sure that input must be in this form 
-    [value, number of zeros padded to the left]
-    '''
-    value_of_bit_1 = bit_1[0]
-    value_of_bit_2 = bit_2[0]
-    total_bits = get_bit_length(value_of_bit_1) + get_bit_length(value_of_bit_2) + bit_1[1] + bit_2[1]
-
-    #pad to left(including 0s padded to left of bit 2), allowing for concatenation
-    value_of_bit_1 = value_of_bit_1 << (get_bit_length(value_of_bit_2) + bit_2[1]) 
-    value_of_bit_1 = value_of_bit_1 | value_of_bit_2 # concatenate accordingly
-
-    number_of_0_padded = total_bits - get_bit_length(value_of_bit_1)
-    return [value_of_bit_1,number_of_0_padded]
-
-
-def take_away_8bit(bit, byte_array):
-    '''
-    A function to take away the first 8 bits and append it to the bytearray
-    Make sure that input must be in this form 
-    [value, number of zeros padded to the left]
-    '''
-    number = bit[0]
-    total_bits = bit[1] + get_bit_length(number)
-
-    #remove the remaining bits that we want to continue with
-    temp = number >> (total_bits - 8)
-
-    #add to byte array
-    byte_array.append(temp)
-
-    #prepare for XOR operation
-    temp = temp << (total_bits - 8)
-
-    #take away the first 8 bits with XOR operation
-    number = number ^ temp
-    bits_remaining = total_bits - 8
-    number_of_0_padded = bits_remaining - get_bit_length(number)
-    return [number,number_of_0_padded], byte_array
+    return combined_bits, bit_pointer
 
 
 
@@ -614,7 +927,24 @@ def z_algo_condition_in_box(z_array,remaining,pointer,left_boundary,right_bounda
 
 
 if __name__ == "__main__":
-    text_file_name = sys.argv[1]
-    window_buffer = sys.argv[2]
-    lookahead_buffer = sys.argv[3]
-    compress_txt_file(text_file_name,int(window_buffer),int(lookahead_buffer))
\ No newline at end of file
+    parser = argparse.ArgumentParser(description = "Encode a file with lz77")
+    parser.add_argument("filename")
+    parser.add_argument("window_buffer", type = int)
+    parser.add_argument("lookahead_buffer", type = int)
+    parser.add_argument("match_finder", nargs = "?", default = "hash_chain", choices = ["hash_chain", "binary_tree", "z"])
+    parser.add_argument("--level", type = int, default = None, choices = sorted(COMPRESSION_LEVELS), help = "1-3 greedy, 4-6 lazy, 7-9 optimal parse, higher is smaller and slower")
+    parser.add_argument("--stream", action = "store_true", help = "encode block by block with bounded memory")
+    parser.add_argument("--workers", type = int, default = None, help = "write a block container, encoded by this many processes")
+    parser.add_argument("--block-size", type = int, default = PARALLEL_BLOCK_SIZE, help = "number of characters per block of a block container")
+    parser.add_argument("--seekable", action = "store_true", help = "write a seekable container, parts of it can be decoded with myunzip.py --range")
+    parser.add_argument("--seek-block-size", type = int, default = SEEK_BLOCK_SIZE, help = "number of characters per block of a seekable container")
+    args = parser.parse_args()
+
+    if args.seekable:
+        compress_txt_file_seekable(args.filename, args.window_buffer, args.lookahead_buffer, args.match_finder, args.seek_block_size, args.level)
+    elif args.workers is not None:
+        compress_txt_file_parallel(args.filename, args.window_buffer, args.lookahead_buffer, args.match_finder, args.workers, args.block_size, args.level)
+    elif args.stream:
+        compress_txt_file_streaming(args.filename, args.window_buffer, args.lookahead_buffer, args.match_finder, level = args.level)
+    else:
+        compress_txt_file(args.filename, args.window_buffer, args.lookahead_buffer, args.match_finder, args.level)